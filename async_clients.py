@@ -0,0 +1,92 @@
+# --------------------
+# Async API clients
+# --------------------
+# One pooled aiohttp session shared by every OpenAI and Pinecone call, explicit
+# concurrency limits for each upstream, and a small bounded thread pool for the
+# blocking work that is left (chat-log file and SQLite I/O, local vector math)
+# so none of it runs on the event loop thread.
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import openai
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 100))
+HTTP_TIMEOUT = 60
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', 16))
+VECTOR_CONCURRENCY = int(os.environ.get('VECTOR_CONCURRENCY', 16))
+BLOCKING_IO_WORKERS = int(os.environ.get('BLOCKING_IO_WORKERS', 8))
+
+_session = None
+_embedding_semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+_vector_semaphore = asyncio.Semaphore(VECTOR_CONCURRENCY)
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+
+
+def http_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return _session
+
+
+def _use_shared_session():
+    # openai reads its session from a context variable, so set it in the calling task
+    openai.aiosession.set(http_session())
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking function on the bounded I/O pool instead of the loop thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, lambda: fn(*args))
+
+
+async def embedding_create(**kwargs):
+    _use_shared_session()
+    async with _embedding_semaphore:
+        return await openai.Embedding.acreate(**kwargs)
+
+
+async def chat_completion_create(**kwargs):
+    _use_shared_session()
+    return await openai.ChatCompletion.acreate(**kwargs)
+
+
+class AsyncPineconeIndex:
+    """Minimal async client for a Pinecone index's REST API over the shared session."""
+
+    def __init__(self, host, api_key):
+        self.host = host
+        self.api_key = api_key
+
+    async def _post(self, path, payload):
+        async with _vector_semaphore:
+            async with http_session().post(f"{self.host}{path}", json=payload,
+                                           headers={"Api-Key": self.api_key}) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def upsert(self, vectors, namespace):
+        await self._post("/vectors/upsert", {
+            "vectors": [{"id": unique_id, "values": list(map(float, vector))} for unique_id, vector in vectors],
+            "namespace": namespace,
+        })
+
+    async def query(self, vector, top_k, namespace):
+        query_results = await self._post("/query", {
+            "vector": list(map(float, vector)),
+            "topK": top_k,
+            "namespace": namespace,
+        })
+        return [(match['id'], match['score']) for match in query_results.get('matches', [])]
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
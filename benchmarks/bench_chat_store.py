@@ -0,0 +1,57 @@
+# --------------------
+# Chat store benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_chat_store
+# Compares the one-file-per-segment layout with the SQLite backend for the
+# operations the bot performs: saving a conversation, loading a user's full
+# history on !chat and loading their last few messages.
+import os
+import time
+import tempfile
+
+from chat_store import JsonFileChatStore, SqliteChatStore, split_segments, migrate_json_to_sqlite
+
+USERS = 20
+CONVERSATIONS_PER_USER = 50
+MESSAGES_PER_CONVERSATION = 12
+
+
+def conversation(user_id, n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"user {user_id} conversation {n} message {i}"}
+            for i in range(MESSAGES_PER_CONVERSATION)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(store):
+    save = timed(lambda: [store.save_segments(user_id, split_segments(conversation(user_id, n)))
+                          for n in range(CONVERSATIONS_PER_USER) for user_id in range(USERS)])
+    load = timed(lambda: [store.load_history(user_id) for user_id in range(USERS)])
+    recent = timed(lambda: [store.recent_messages(user_id, 10) for user_id in range(USERS)])
+    return save, load / USERS, recent / USERS
+
+
+def main():
+    segments = USERS * CONVERSATIONS_PER_USER * len(split_segments(conversation(0, 0)))
+    print(f"{segments} segments across {USERS} users")
+    print(f"{'backend':>8} {'save all (s)':>13} {'load history (ms)':>18} {'recent 10 (ms)':>15}")
+    with tempfile.TemporaryDirectory() as chat_logs_folder:
+        json_store = JsonFileChatStore(chat_logs_folder)
+        save, load, recent = run(json_store)
+        print(f"{'json':>8} {save:>13.2f} {load * 1e3:>18.2f} {recent * 1e3:>15.2f}")
+
+        start = time.perf_counter()
+        migrated = migrate_json_to_sqlite(chat_logs_folder, os.path.join(chat_logs_folder, "migrated.db"))
+        print(f"migrated {migrated} segments in {time.perf_counter() - start:.2f}s")
+
+    with tempfile.TemporaryDirectory() as chat_logs_folder:
+        save, load, recent = run(SqliteChatStore(os.path.join(chat_logs_folder, "chat_logs.db")))
+        print(f"{'sqlite':>8} {save:>13.2f} {load * 1e3:>18.2f} {recent * 1e3:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# --------------------
+# Context builder replay
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_context_builder [chat_logs_folder]
+# Replays every user turn found in a chat_logs tree and compares the prompt
+# the old concatenation would have sent with the one build_context sends.
+# Retrieval is simulated by returning the segments around the turn (what
+# semantic search tends to hit) plus a couple of random older ones. Without a
+# folder argument a synthetic corpus is generated instead.
+import sys
+import time
+import random
+from collections import defaultdict
+
+from chat_store import iter_chat_log_files, save_order
+from context_builder import build_context, messages_tokens
+
+SYSTEM_MESSAGES = [{"role": "system", "content": "You are Bearsworth, a friendly and knowledgeable bear. " * 8}]
+RECENT_WINDOW = 6
+TOP_K = 3
+BUDGET = 3500
+MODEL_LIMIT = 4096 - 400
+
+
+def load_corpus(chat_logs_folder):
+    chat_logs = defaultdict(list)
+    for _, chat_log in iter_chat_log_files(chat_logs_folder):
+        chat_logs[chat_log["metadata"]["user_id"]].append(chat_log)
+    return {user_id: [chat_log["chat_history"] for chat_log in sorted(user_chat_logs, key=save_order)]
+            for user_id, user_chat_logs in chat_logs.items()}
+
+
+def synthetic_corpus(users=50, segments_per_user=60, seed=0):
+    rng = random.Random(seed)
+    corpus = {}
+    for user_id in range(users):
+        history = []
+        for i in range(segments_per_user * 3):
+            role = "user" if i % 2 == 0 else "assistant"
+            words = rng.randint(5, 40) if role == "user" else rng.randint(30, 250)
+            history.append({"role": role, "content": " ".join(f"w{rng.randint(0, 5000)}" for _ in range(words))})
+        corpus[user_id] = [history[i:i + 3] for i in range(0, len(history), 3)]
+    return corpus
+
+
+def replay(corpus, seed=0):
+    rng = random.Random(seed)
+    naive_total = built_total = turns = naive_over = duplicates = 0
+    build_time = 0.0
+    for segments in corpus.values():
+        history = [message for segment in segments for message in segment]
+        segment_of = [i for i, segment in enumerate(segments) for _ in segment]
+        for i, message in enumerate(history):
+            if message["role"] != "user":
+                continue
+            # As in the bot, the new user message is already in the recent history when the prompt is built
+            recent = history[max(0, i + 1 - RECENT_WINDOW):i + 1]
+            nearby = [segment_of[i]] + ([segment_of[i] - 1] if segment_of[i] > 0 else [])
+            older = rng.sample(range(len(segments)), min(TOP_K - len(nearby), len(segments)))
+            relevant = [segments[j] for j in (nearby + older)[:TOP_K]]
+
+            naive = SYSTEM_MESSAGES + [m for segment in relevant for m in segment] + recent + [message]
+            naive_tokens = messages_tokens(naive)
+            start = time.perf_counter()
+            _, stats = build_context(SYSTEM_MESSAGES, relevant, recent, message, BUDGET)
+            build_time += time.perf_counter() - start
+
+            naive_total += naive_tokens
+            built_total += stats["tokens"]
+            naive_over += naive_tokens > MODEL_LIMIT
+            duplicates += stats["duplicates"]
+            turns += 1
+    return naive_total, built_total, turns, naive_over, duplicates, build_time
+
+
+def main():
+    if len(sys.argv) > 1:
+        corpus = load_corpus(sys.argv[1])
+        source = sys.argv[1]
+    else:
+        corpus = synthetic_corpus()
+        source = "synthetic corpus"
+    naive_total, built_total, turns, naive_over, duplicates, build_time = replay(corpus)
+    if not turns:
+        print(f"No user turns found in {source}")
+        return
+    print(f"Replayed {turns} turns from {len(corpus)} users ({source})")
+    print(f"prompt tokens, old concatenation: {naive_total} ({naive_total / turns:.0f}/turn)")
+    print(f"prompt tokens, build_context:     {built_total} ({built_total / turns:.0f}/turn)")
+    print(f"saved: {1 - built_total / naive_total:.1%}, duplicate messages removed: {duplicates}")
+    print(f"old prompts over the {MODEL_LIMIT}-token limit: {naive_over}; build_context budget: {BUDGET}")
+    print(f"build_context time: {build_time / turns * 1e6:.0f} us/turn")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# --------------------
+# Embedding pipeline benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_embedding_pipeline
+# Compares the old save path (one embedding call and one upsert per segment,
+# one after another) with the batched pipeline, using fake backends with
+# network-like latency and a small injected failure rate.
+import time
+import random
+import asyncio
+
+from benchmarks.fakes import FakeEmbedder, FakeIndex
+from embedding_pipeline import embed_and_upsert
+
+SEGMENTS = [10, 100, 1000]
+FAILURE_RATE = 0.05
+
+
+def segments(count):
+    return [(f"segment-{i}", f"user says {i} assistant replies {i}") for i in range(count)]
+
+
+async def per_segment_loop(items, embedder, index):
+    for unique_id, text in items:
+        vector = await embedder.embed(text)
+        await index.upsert([(unique_id, vector)], namespace="convo-logs")
+
+
+async def main():
+    random.seed(0)
+    print(f"{'segments':>8} {'loop seg/s':>11} {'batched seg/s':>14} {'loop calls':>11} {'batched calls':>14}")
+    for count in SEGMENTS:
+        items = segments(count)
+
+        embedder, index = FakeEmbedder(), FakeIndex()
+        start = time.perf_counter()
+        await per_segment_loop(items, embedder, index)
+        loop_rate = count / (time.perf_counter() - start)
+        loop_calls = embedder.calls + index.calls
+
+        embedder, index = FakeEmbedder(failure_rate=FAILURE_RATE), FakeIndex(failure_rate=FAILURE_RATE)
+        start = time.perf_counter()
+        failed = await embed_and_upsert(items, embedder.embed_batch, index.upsert, retry_delay=0.01)
+        batched_rate = count / (time.perf_counter() - start)
+        assert not failed and index.count("convo-logs") == count, "batched pipeline lost segments"
+
+        print(f"{count:>8} {loop_rate:>11.0f} {batched_rate:>14.0f} {loop_calls:>11} "
+              f"{embedder.calls + index.calls:>14}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+# --------------------
+# Event loop lag benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_loop_lag
+# Drives concurrent simulated turns and measures event loop lag with
+# LoopLagMonitor. The "blocking" turn mirrors the old get_response: a
+# synchronous vector query and chat-log read on the loop thread, then the
+# completion in the default executor. The "async" turn awaits non-blocking
+# upstream calls and moves file I/O onto the bounded I/O pool.
+import time
+import asyncio
+
+from async_clients import run_blocking
+from loop_monitor import LoopLagMonitor
+
+CONCURRENT_USERS = 30
+DURATION = 5.0
+VECTOR_QUERY_LATENCY = 0.06
+FILE_READ_LATENCY = 0.005
+COMPLETION_LATENCY = 0.5
+
+
+async def blocking_turn():
+    time.sleep(VECTOR_QUERY_LATENCY)  # indexer.query on the loop thread
+    time.sleep(FILE_READ_LATENCY)  # chat-log read on the loop thread
+    await asyncio.get_running_loop().run_in_executor(None, time.sleep, COMPLETION_LATENCY)
+
+
+async def async_turn():
+    await asyncio.sleep(VECTOR_QUERY_LATENCY)  # AsyncPineconeIndex.query
+    await run_blocking(time.sleep, FILE_READ_LATENCY)  # chat-log read on the I/O pool
+    await asyncio.sleep(COMPLETION_LATENCY)  # ChatCompletion.acreate
+
+
+async def measure(turn):
+    monitor = LoopLagMonitor(interval=0.01, report_every=0, warn_threshold=float("inf"))
+    monitor.start()
+    deadline = time.monotonic() + DURATION
+    turns = 0
+
+    async def user():
+        nonlocal turns
+        while time.monotonic() < deadline:
+            await turn()
+            turns += 1
+
+    await asyncio.gather(*(user() for _ in range(CONCURRENT_USERS)))
+    monitor.stop()
+    return monitor.stats(), turns / DURATION
+
+
+async def main():
+    print(f"{CONCURRENT_USERS} concurrent users for {DURATION:.0f}s")
+    print(f"{'':>9} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11} {'turns/s':>8}")
+    for name, turn in (("blocking", blocking_turn), ("async", async_turn)):
+        stats, rate = await measure(turn)
+        print(f"{name:>9} {stats['p50'] * 1e3:>11.1f} {stats['p99'] * 1e3:>11.1f} "
+              f"{stats['max'] * 1e3:>11.1f} {rate:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+# --------------------
+# Recent messages benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_recent_messages
+# Regression check for one heavy user with 10k saved segments: loading the last
+# few messages through the per-user manifest should only open the newest files,
+# while the old timestamp sort parsed every file twice.
+import os
+import json
+import time
+import tempfile
+
+from chat_store import JsonFileChatStore, split_segments
+
+SEGMENTS = 10_000
+USER_ID = 1234
+RECENT = 10
+
+
+def legacy_recent_messages(user_id, num_messages, chat_logs_folder):
+    user_folder = os.path.join(chat_logs_folder, str(user_id))
+    chat_files = []
+    for root, _, files in os.walk(user_folder):
+        for file in files:
+            if file.endswith(".json"):
+                chat_files.append(os.path.join(root, file))
+
+    chat_files.sort(key=lambda x: json.load(open(x))["metadata"]["timestamp"], reverse=True)
+
+    recent_messages = []
+    for chat_file in chat_files:
+        with open(chat_file, "r") as file:
+            segmented_chat_log = json.load(file)
+            if segmented_chat_log["metadata"]["user_id"] == user_id:
+                recent_messages.extend(segmented_chat_log["chat_history"])
+            if len(recent_messages) >= num_messages:
+                break
+    return recent_messages[-num_messages:]
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as chat_logs_folder:
+        store = JsonFileChatStore(chat_logs_folder)
+        history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+                   for i in range(SEGMENTS * 3)]
+        # Save in conversation-sized chunks, many of which land in the same second
+        for i in range(0, len(history), 30):
+            store.save_segments(USER_ID, split_segments(history[i:i + 30]))
+
+        legacy, _ = timed(lambda: legacy_recent_messages(USER_ID, RECENT, chat_logs_folder), repeat=1)
+        manifest, recent = timed(lambda: store.recent_messages(USER_ID, RECENT))
+        full, loaded = timed(lambda: store.load_history(USER_ID), repeat=1)
+
+        assert recent == history[-RECENT:], "recent messages out of order"
+        assert loaded == history, "full history out of order"
+        print(f"{SEGMENTS} segments for one user")
+        print(f"legacy recent {RECENT}:   {legacy * 1e3:9.1f} ms")
+        print(f"manifest recent {RECENT}: {manifest * 1e3:9.1f} ms")
+        print(f"manifest full history: {full * 1e3:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
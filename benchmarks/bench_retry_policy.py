@@ -0,0 +1,119 @@
+# --------------------
+# Retry policy fault-injection run
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_retry_policy
+# Drives concurrent users against a local stub upstream that goes through a
+# healthy phase, a rate-limit storm (429s with Retry-After), a full outage
+# (503s) and recovery, with a trickle of fatal 400s throughout. Compares the
+# old loop (10 attempts, fixed 1s sleep, retrieval redone every attempt) with
+# RetryPolicy + CircuitBreaker, counting upstream calls and outcomes.
+import time
+import random
+import asyncio
+
+import numpy as np
+import openai
+
+from retry_policy import RetryPolicy, CircuitBreaker, CircuitOpenError, classify_error, RATE_LIMIT, TIMEOUT, FATAL
+
+USERS = 30
+DURATION = 16.0
+PHASES = [  # (ends at second, rate-limited fraction, outage)
+    (4.0, 0.0, False),
+    (8.0, 0.6, False),
+    (12.0, 0.0, True),
+    (DURATION, 0.0, False),
+]
+FATAL_FRACTION = 0.02
+CALL_LATENCY = 0.2
+EMBED_LATENCY = 0.05
+
+
+class FaultyUpstream:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.completion_calls = 0
+        self.embedding_calls = 0
+
+    def _phase(self):
+        elapsed = time.monotonic() - self.start
+        for ends_at, rate_limited, outage in PHASES:
+            if elapsed < ends_at:
+                return rate_limited, outage
+        return PHASES[-1][1:]
+
+    async def embed(self):
+        self.embedding_calls += 1
+        await asyncio.sleep(EMBED_LATENCY)
+
+    async def complete(self):
+        self.completion_calls += 1
+        await asyncio.sleep(CALL_LATENCY)
+        rate_limited, outage = self._phase()
+        if outage:
+            raise openai.error.ServiceUnavailableError("injected outage", http_status=503)
+        if random.random() < rate_limited:
+            raise openai.error.RateLimitError("injected rate limit", http_status=429, headers={"Retry-After": "1"})
+        if random.random() < FATAL_FRACTION:
+            raise openai.error.InvalidRequestError("injected bad request", param=None, http_status=400)
+        return "ok"
+
+
+async def legacy_turn(upstream):
+    for attempt in range(10):
+        try:
+            await upstream.embed()  # retrieval redone on every attempt
+            return await upstream.complete()
+        except Exception:
+            if attempt < 9:
+                await asyncio.sleep(1)
+            else:
+                raise
+
+
+def policy_turn_factory():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=20,
+                         breaker=CircuitBreaker(failure_threshold=10, reset_timeout=2))
+
+    async def turn(upstream):
+        await upstream.embed()  # retrieval once
+        return await policy.run(upstream.complete)
+    return turn
+
+
+async def run(name, turn):
+    random.seed(0)
+    upstream = FaultyUpstream()
+    deadline = upstream.start + DURATION
+    latencies = []
+    outcomes = {"ok": 0, RATE_LIMIT: 0, TIMEOUT: 0, FATAL: 0, "fast_fail": 0}
+
+    async def user():
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                await turn(upstream)
+                outcomes["ok"] += 1
+            except CircuitOpenError:
+                outcomes["fast_fail"] += 1
+                await asyncio.sleep(0.5)  # the user reads the apology before trying again
+            except Exception as e:
+                outcomes[classify_error(e)] += 1
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(user() for _ in range(USERS)))
+    print(f"{name:>7} {upstream.completion_calls:>11} {upstream.embedding_calls:>10} {outcomes['ok']:>5} "
+          f"{outcomes[FATAL]:>6} {outcomes[RATE_LIMIT] + outcomes[TIMEOUT]:>10} {outcomes['fast_fail']:>10} "
+          f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
+
+
+async def main():
+    print(f"{USERS} users for {DURATION:.0f}s: healthy, 429 storm, 503 outage, recovery")
+    print(f"{'':>7} {'completions':>11} {'embeddings':>10} {'ok':>5} {'fatal':>6} {'exhausted':>10} "
+          f"{'fast fail':>10} {'p50 s':>8} {'p99 s':>8}")
+    await run("legacy", legacy_turn)
+    await run("policy", policy_turn_factory())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+# --------------------
+# Request scheduler load test
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_scheduler
+# Replays the same request stream through the old batch-and-gather loop and
+# through FairScheduler, against a stubbed completion backend with a slow
+# tail, and reports p50/p99 queue wait and end-to-end latency. One "heavy"
+# user bursts many requests at once to show per-user fairness.
+import time
+import random
+import asyncio
+
+import numpy as np
+
+from request_scheduler import FairScheduler
+
+SLOTS = 30
+USERS = 50
+REQUESTS = 600
+ARRIVAL_RATE = 60  # requests per second
+HEAVY_USER_BURST = 100
+SLOW_FRACTION = 0.03
+SLOW_LATENCY = 3.0
+
+
+def completion_latency(rng):
+    if rng.random() < SLOW_FRACTION:
+        return SLOW_LATENCY
+    return rng.lognormvariate(np.log(0.2), 0.4)
+
+
+def request_stream(seed=0):
+    """(arrival_offset, user_id, latency) tuples; user 0 bursts at t=1s."""
+    rng = random.Random(seed)
+    stream = []
+    t = 0.0
+    for _ in range(REQUESTS):
+        t += rng.expovariate(ARRIVAL_RATE)
+        stream.append((t, rng.randrange(1, USERS), completion_latency(rng)))
+    stream += [(1.0, 0, completion_latency(rng)) for _ in range(HEAVY_USER_BURST)]
+    stream.sort(key=lambda request: request[0])
+    return stream
+
+
+class Recorder:
+    def __init__(self):
+        self.queue_waits = []
+        self.latencies = []
+        self.light_user_latencies = []
+
+    async def handler(self, user_id, enqueued_at, latency):
+        self.queue_waits.append(time.monotonic() - enqueued_at)
+        await asyncio.sleep(latency)
+        return latency
+
+    def report(self, name, elapsed):
+        def ms(values, q):
+            return np.percentile(values, q) * 1e3
+        print(f"{name:>10} {ms(self.queue_waits, 50):>9.0f} {ms(self.queue_waits, 99):>9.0f} "
+              f"{ms(self.latencies, 50):>9.0f} {ms(self.latencies, 99):>9.0f} "
+              f"{ms(self.light_user_latencies, 99):>12.0f} {len(self.latencies) / elapsed:>8.1f}")
+
+
+async def drive(stream, submit, recorder):
+    start = time.monotonic()
+
+    async def one(offset, user_id, latency):
+        await asyncio.sleep(max(0.0, start + offset - time.monotonic()))
+        enqueued_at = time.monotonic()
+        response_future = await submit(user_id, enqueued_at, latency)
+        await response_future
+        elapsed = time.monotonic() - enqueued_at
+        recorder.latencies.append(elapsed)
+        if user_id != 0:
+            recorder.light_user_latencies.append(elapsed)
+
+    await asyncio.gather(*(one(*request) for request in stream))
+    return time.monotonic() - start
+
+
+async def legacy(stream):
+    """The original process_requests loop, driven by the same stream."""
+    recorder = Recorder()
+    request_queue = asyncio.Queue()
+    api_semaphore = asyncio.Semaphore(SLOTS)
+
+    async def get_response(user_id, enqueued_at, latency):
+        async with api_semaphore:
+            return await recorder.handler(user_id, enqueued_at, latency)
+
+    async def process_requests():
+        while True:
+            tasks = []
+            for _ in range(api_semaphore._value):
+                if not request_queue.empty():
+                    user_id, enqueued_at, latency, response_future = await request_queue.get()
+                    task = asyncio.create_task(get_response(user_id, enqueued_at, latency))
+                    tasks.append((task, response_future))
+                    request_queue.task_done()
+                else:
+                    break
+            if tasks:
+                results = await asyncio.gather(*(task for task, _ in tasks), return_exceptions=True)
+                for (task, response_future), result in zip(tasks, results):
+                    response_future.set_result(result)
+            try:
+                await asyncio.wait_for(request_queue.join(), timeout=0.5)
+            except asyncio.exceptions.TimeoutError:
+                pass
+
+    async def submit(user_id, enqueued_at, latency):
+        response_future = asyncio.get_running_loop().create_future()
+        await request_queue.put((user_id, enqueued_at, latency, response_future))
+        return response_future
+
+    processor = asyncio.create_task(process_requests())
+    elapsed = await drive(stream, submit, recorder)
+    processor.cancel()
+    recorder.report("legacy", elapsed)
+
+
+async def scheduled(stream):
+    recorder = Recorder()
+    scheduler = FairScheduler(recorder.handler, workers=SLOTS, max_queue=200)
+    scheduler.start()
+    elapsed = await drive(stream, scheduler.submit, recorder)
+    await scheduler.stop()
+    recorder.report("scheduler", elapsed)
+
+
+async def main():
+    stream = request_stream()
+    print(f"{len(stream)} requests, {SLOTS} slots, {SLOW_FRACTION:.0%} of calls take {SLOW_LATENCY}s")
+    print(f"{'':>10} {'wait p50':>9} {'wait p99':>9} {'e2e p50':>9} {'e2e p99':>9} "
+          f"{'light e2e p99':>12} {'req/s':>8}   (ms)")
+    await legacy(stream)
+    await scheduled(stream)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
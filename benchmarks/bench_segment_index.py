@@ -0,0 +1,82 @@
+# --------------------
+# Segment index benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_segment_index
+# Shows that resolving Pinecone hits through the segment index stays flat as
+# the number of users grows, while the old per-folder probe grows linearly.
+import os
+import json
+import time
+import random
+import tempfile
+import uuid as uuid_lib
+
+import segment_index
+
+USER_COUNTS = [100, 1_000, 10_000, 100_000]
+SEGMENTS_PER_USER = 3
+LOOKUPS = 2_000
+TOP_K = 3
+LEGACY_MAX_USERS = 10_000
+
+
+def populate(chat_logs_folder, num_users, write_files):
+    ids = []
+    batch = []
+    for user_id in range(num_users):
+        user_folder = os.path.join(chat_logs_folder, str(user_id))
+        if write_files:
+            os.makedirs(user_folder, exist_ok=True)
+        for _ in range(SEGMENTS_PER_USER):
+            unique_id = str(uuid_lib.uuid4())
+            segment = [{"role": "user", "content": f"hello from {user_id}"}]
+            file_path = os.path.join(user_folder, f"{unique_id}.json")
+            if write_files:
+                with open(file_path, "w") as f:
+                    json.dump({"metadata": {"unique_id": unique_id, "user_id": user_id},
+                               "chat_history": segment}, f)
+            batch.append((unique_id, user_id, file_path, segment))
+            ids.append(unique_id)
+    segment_index.add_segments(batch, chat_logs_folder)
+    return ids
+
+
+def legacy_lookup(chat_logs_folder, unique_ids):
+    messages = []
+    for uuid_val in unique_ids:
+        for user_folder in os.listdir(chat_logs_folder):
+            folder_path = os.path.join(chat_logs_folder, user_folder)
+            if not os.path.isdir(folder_path):
+                continue
+            file_path = os.path.join(folder_path, f"{uuid_val}.json")
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, "r") as f:
+                messages.extend(json.load(f)["chat_history"])
+    return messages
+
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    print(f"{'users':>8} {'index us/query':>15} {'legacy us/query':>16}")
+    for num_users in USER_COUNTS:
+        with tempfile.TemporaryDirectory() as chat_logs_folder:
+            write_files = num_users <= LEGACY_MAX_USERS
+            ids = populate(chat_logs_folder, num_users, write_files)
+            queries = [random.sample(ids, TOP_K) for _ in range(LOOKUPS)]
+            indexed = time_per_query(lambda q: segment_index.lookup_segments(q, chat_logs_folder), queries)
+            legacy = "-"
+            if write_files:
+                legacy_queries = queries[:max(1, LOOKUPS // num_users)]
+                legacy = f"{time_per_query(lambda q: legacy_lookup(chat_logs_folder, q), legacy_queries):.0f}"
+            print(f"{num_users:>8} {indexed:>15.1f} {legacy:>16}")
+
+
+if __name__ == "__main__":
+    main()
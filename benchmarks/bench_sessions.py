@@ -0,0 +1,76 @@
+# --------------------
+# Session memory benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_sessions
+# Simulates 50k users chatting and measures the memory held by session state:
+# the old dict of message-dict lists, SessionManager without a cap, and
+# SessionManager with a 16 MB cap (evicted sessions are counted, as the bot
+# would hand them to save_chat_history).
+import random
+import tracemalloc
+
+from session_manager import SessionManager
+
+USERS = 50_000
+TURNS_PER_USER = 4
+CAPPED_LIMIT = 16 * 1024 * 1024
+
+
+def conversation_stream(seed=0):
+    rng = random.Random(seed)
+    for turn in range(TURNS_PER_USER):
+        for user_id in range(USERS):
+            yield user_id, "user", "q" * rng.randint(20, 120)
+            yield user_id, "assistant", "a" * rng.randint(150, 700)
+
+
+def legacy():
+    user_chat_histories = {}
+    for user_id, role, content in conversation_stream():
+        if user_id not in user_chat_histories:
+            user_chat_histories[user_id] = []
+        user_chat_histories[user_id].append({"role": role, "content": content})
+        user_chat_histories[user_id] = user_chat_histories[user_id][-6:]
+    return user_chat_histories, None
+
+
+def managed(memory_limit):
+    flushed = []
+    sessions = SessionManager(max_history=6, memory_limit=memory_limit,
+                              on_evict=lambda user_id, messages: flushed.append(len(messages)))
+    for user_id, role, content in conversation_stream():
+        sessions.append(user_id, role, content)
+    return sessions, flushed
+
+
+def measure(build):
+    tracemalloc.start()
+    state, flushed = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return state, flushed, current
+
+
+def main():
+    print(f"{USERS} users, {TURNS_PER_USER} turns each, 6 messages kept per session")
+    print(f"{'':>22} {'traced MB':>10} {'estimate MB':>12} {'sessions':>9} {'evicted':>8}")
+
+    state, _, current = measure(legacy)
+    print(f"{'dict of dict lists':>22} {current / 2**20:>10.1f} {'-':>12} {len(state):>9} {0:>8}")
+    del state
+
+    state, _, current = measure(lambda: managed(10 * 2**30))
+    stats = state.memory_stats()
+    print(f"{'SessionManager':>22} {current / 2**20:>10.1f} {stats['estimated_bytes'] / 2**20:>12.1f} "
+          f"{stats['sessions']:>9} {stats['evictions']:>8}")
+    del state
+
+    state, flushed, current = measure(lambda: managed(CAPPED_LIMIT))
+    stats = state.memory_stats()
+    print(f"{'SessionManager 16MB':>22} {current / 2**20:>10.1f} {stats['estimated_bytes'] / 2**20:>12.1f} "
+          f"{stats['sessions']:>9} {stats['evictions']:>8}")
+    print(f"evicted sessions flushed: {len(flushed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# --------------------
+# Streaming reply benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_streaming
+# Compares when the user first sees text with and without streaming, using a
+# fake completion backend and a fake Discord channel, and counts the message
+# edits streaming costs.
+import time
+import asyncio
+
+from benchmarks.fakes import FakeCompletion, FakeChannel
+from streaming import StreamingReply, stream_completion_text
+
+
+async def blocking_reply(completion, channel):
+    start = time.monotonic()
+    response = await completion.acreate(messages=[])
+    await channel.send(response["choices"][0]["message"]["content"].strip())
+    return time.monotonic() - start, time.monotonic() - start
+
+
+async def streaming_reply(completion, channel):
+    start = time.monotonic()
+    reply = StreamingReply(channel)
+    chunks = []
+    async for delta in stream_completion_text(await completion.acreate(stream=True, messages=[])):
+        chunks.append(delta)
+        await reply.feed(delta)
+    await reply.finish("".join(chunks).strip())
+    return reply.first_post_at - start, time.monotonic() - start
+
+
+async def main():
+    print(f"{'tokens':>7} {'mode':>10} {'first text s':>13} {'complete s':>11} {'edits':>6}")
+    for tokens in (50, 150, 400):
+        for name, run in (("blocking", blocking_reply), ("streaming", streaming_reply)):
+            channel = FakeChannel()
+            first, complete = await run(FakeCompletion(tokens=tokens), channel)
+            assert channel.messages[-1].content.endswith(f"word{tokens - 1}"), "final text incomplete"
+            print(f"{tokens:>7} {name:>10} {first:>13.2f} {complete:>11.2f} {channel.edits:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+# --------------------
+# Local vector store benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_vector_store [dimension]
+# Measures LocalVectorStore query latency and recall@k against a brute-force
+# full sort over the same vectors. The store answers with an exact
+# argpartition top-k, so recall should be 1.0; the point is the latency.
+# The default dimension is lower than ada-002's 1536 so the 1M run fits in memory.
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from vector_store import LocalVectorStore
+
+SIZES = [10_000, 100_000, 1_000_000]
+QUERIES = 50
+TOP_K = 10
+CHUNK = 10_000
+
+
+def brute_force(matrix, query, top_k):
+    scores = matrix @ query
+    return np.argsort(-scores)[:top_k]
+
+
+def main():
+    dimension = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    rng = np.random.default_rng(0)
+    print(f"dimension {dimension}, top_k {TOP_K}")
+    print(f"{'vectors':>9} {'store p50 ms':>13} {'store p99 ms':>13} {'brute p50 ms':>13} {'recall':>7}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as folder:
+            store = LocalVectorStore(folder, dimension=dimension)
+            for start in range(0, size, CHUNK):
+                vectors = rng.standard_normal((min(CHUNK, size - start), dimension), dtype=np.float32)
+                store.upsert([(str(start + i), vector) for i, vector in enumerate(vectors)], "bench")
+            matrix = np.array(store._partition("bench").matrix[:size])
+
+            store_times, brute_times, recalls = [], [], []
+            for _ in range(QUERIES):
+                query = rng.standard_normal(dimension, dtype=np.float32)
+                query /= np.linalg.norm(query)
+
+                t = time.perf_counter()
+                matches = store.query(query, TOP_K, "bench")
+                store_times.append(time.perf_counter() - t)
+
+                t = time.perf_counter()
+                expected = brute_force(matrix, query, TOP_K)
+                brute_times.append(time.perf_counter() - t)
+
+                recalls.append(len({int(unique_id) for unique_id, _ in matches} & set(expected.tolist())) / TOP_K)
+
+            print(f"{size:>9} {np.percentile(store_times, 50) * 1e3:>13.2f} "
+                  f"{np.percentile(store_times, 99) * 1e3:>13.2f} "
+                  f"{np.percentile(brute_times, 50) * 1e3:>13.2f} {np.mean(recalls):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# --------------------
+# Write-behind persistence benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.bench_write_behind
+# 1. Ends CONVERSATIONS conversations at once and compares how long each end
+#    takes, and how many embedding/upsert calls are made, when saving inline
+#    (the old save_chat_history) versus through WriteBehindQueue.
+# 2. Crash test: a child process enqueues conversations and is killed with
+#    os._exit right after the chat store write of one of them, before the log
+#    records it as saved. A new queue on the same log must resume every
+#    unfinished job, so each conversation ends up saved exactly once and every
+#    saved segment indexed. Exits non-zero if anything was lost or duplicated.
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+from async_clients import run_blocking
+from chat_store import JsonFileChatStore, split_segments
+from embedding_pipeline import embed_and_upsert
+from write_behind import WriteBehindQueue
+from benchmarks.fakes import FakeEmbedder, FakeIndex
+
+CONVERSATIONS = 200
+MESSAGES_PER_CONVERSATION = 12
+KILL_AFTER_SAVES = 30
+
+
+def segment_ids(user_id):
+    return [f"{user_id}-{i}" for i in range(len(split_segments(conversation(user_id))))]
+
+
+def conversation(user_id):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"user {user_id} message {i} " * 8}
+            for i in range(MESSAGES_PER_CONVERSATION)]
+
+
+def make_backends(folder):
+    store = JsonFileChatStore(folder)
+    embedder = FakeEmbedder()
+    index = FakeIndex()
+
+    def save(user_id, chat_history, segment_ids=None):
+        return [(unique_id, " ".join(message["content"] for message in segment))
+                for unique_id, segment in store.save_segments(user_id, split_segments(chat_history), segment_ids)]
+
+    async def index_items(items):
+        return await embed_and_upsert(items, embedder.embed_batch, index.upsert, namespace="convo-logs")
+    return store, embedder, index, save, index_items
+
+
+async def inline(folder):
+    store, embedder, index, save, index_items = make_backends(folder)
+    ends = []
+
+    async def end(user_id):
+        started = time.perf_counter()
+        items = await run_blocking(save, user_id, conversation(user_id))
+        await index_items(items)
+        ends.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    await asyncio.gather(*(end(user_id) for user_id in range(CONVERSATIONS)))
+    return ends, time.perf_counter() - started, embedder.calls, index.calls
+
+
+async def write_behind(folder):
+    store, embedder, index, save, index_items = make_backends(folder)
+    queue = WriteBehindQueue(os.path.join(folder, "write_behind.wal"), save, index_items)
+    queue.start()
+    ends = []
+
+    async def end(user_id):
+        started = time.perf_counter()
+        await queue.enqueue(user_id, conversation(user_id), segment_ids(user_id))
+        ends.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    await asyncio.gather(*(end(user_id) for user_id in range(CONVERSATIONS)))
+    await queue.drain()
+    return ends, time.perf_counter() - started, embedder.calls, index.calls
+
+
+def crashing_child(folder):
+    async def main():
+        _, _, _, save, index_items = make_backends(folder)
+        saves = 0
+
+        def save_then_crash(user_id, chat_history, segment_ids):
+            nonlocal saves
+            saved = save(user_id, chat_history, segment_ids)
+            saves += 1
+            if saves == KILL_AFTER_SAVES:
+                os._exit(1)  # segments are in the chat store, the "saved" record isn't; no drain, no cleanup
+            return saved
+
+        async def slow_index(items):
+            await asyncio.sleep(0.2)
+            return await index_items(items)
+        queue = WriteBehindQueue(os.path.join(folder, "write_behind.wal"), save_then_crash, slow_index,
+                                 coalesce_delay=0.05, max_batch_jobs=20)
+        queue.start()
+        for user_id in range(CONVERSATIONS):
+            await queue.enqueue(user_id, conversation(user_id), segment_ids(user_id))
+        await asyncio.sleep(60)
+    asyncio.run(main())
+
+
+async def resume(folder):
+    store, _, index, save, index_items = make_backends(folder)
+    queue = WriteBehindQueue(os.path.join(folder, "write_behind.wal"), save, index_items)
+    queue.start()
+    await queue.drain()
+    return store, index, queue.resumed, len(queue)
+
+
+def report(name, ends, elapsed, embedding_calls, upsert_calls):
+    print(f"{name:>12} {np.percentile(ends, 50) * 1e3:>9.2f} {np.percentile(ends, 99) * 1e3:>9.2f} "
+          f"{elapsed:>10.2f} {embedding_calls:>11} {upsert_calls:>8}")
+
+
+def main():
+    print(f"{CONVERSATIONS} conversations of {MESSAGES_PER_CONVERSATION} messages ending at once")
+    print(f"{'':>12} {'end p50 ms':>9} {'end p99 ms':>9} {'all done s':>10} {'embed calls':>11} {'upserts':>8}")
+    for name, run in (("inline", inline), ("write-behind", write_behind)):
+        folder = tempfile.mkdtemp()
+        try:
+            report(name, *asyncio.run(run(folder)))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    folder = tempfile.mkdtemp()
+    try:
+        # Spawned like the launcher's workers; a forked child would inherit a dead blocking-I/O pool
+        child = multiprocessing.get_context("spawn").Process(target=crashing_child, args=(folder,))
+        child.start()
+        child.join()
+        with open(os.path.join(folder, "write_behind.wal")) as wal:
+            ops = [line.split('"op": "', 1)[1].split('"', 1)[0] for line in wal if '"op": "' in line]
+        store, index, resumed, left = asyncio.run(resume(folder))
+        saved = {user_id: store.load_history(user_id) for user_id in range(CONVERSATIONS)}
+        # Jobs finished before the crash were indexed by the child; the rest must be indexed by the resumed queue
+        expected = (CONVERSATIONS - ops.count("done")) * len(split_segments(conversation(0)))
+        missing = [user_id for user_id, history in saved.items() if not history]
+        duplicated = [user_id for user_id, history in saved.items() if len(history) > MESSAGES_PER_CONVERSATION]
+        indexed = index.count("convo-logs")
+        print(f"crash after save {KILL_AFTER_SAVES} (exit code {child.exitcode}): {ops.count('saved')} jobs logged "
+              f"as saved and {ops.count('done')} indexed before the crash, {resumed} jobs resumed, {left} left after drain")
+        print(f"conversations saved {CONVERSATIONS - len(missing)}/{CONVERSATIONS}, duplicated {len(duplicated)}, "
+              f"segments indexed after resume {indexed}/{expected}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if missing or duplicated or left or indexed != expected:
+        print("FAILED: conversations lost or duplicated across the crash")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# --------------------
+# Local fake backends
+# --------------------
+# Stand-ins for OpenAI and Pinecone used by the benchmarks. Each fake sleeps
+# for a configurable latency and can inject failures, so pipeline code can be
+# exercised without network access. Injected failures are the errors the real
+# clients raise: mostly outages and rate limits, which the retry policy retries,
+# plus a `fatal_share` of rejected requests, which it must not.
+import random
+import asyncio
+import hashlib
+
+import aiohttp
+import numpy as np
+import openai
+import yarl
+
+from context_builder import messages_tokens
+
+EMBEDDING_DIMENSION = 1536
+
+
+def _injected_kind(fatal_share):
+    roll = random.random()
+    if roll < fatal_share:
+        return "rejected"
+    return "unavailable" if roll < (1 + fatal_share) / 2 else "rate_limited"
+
+
+def openai_error(what, fatal_share=0.0):
+    kind = _injected_kind(fatal_share)
+    message = f"injected {what} failure ({kind})"
+    if kind == "rejected":
+        return openai.error.InvalidRequestError(message, None)
+    if kind == "unavailable":
+        return openai.error.ServiceUnavailableError(message)
+    return openai.error.RateLimitError(message)
+
+
+def index_error(what, fatal_share=0.0):
+    """What AsyncPineconeIndex's raise_for_status raises for a failed request."""
+    kind = _injected_kind(fatal_share)
+    url = yarl.URL(f"https://fake-index/{what}")
+    return aiohttp.ClientResponseError(aiohttp.RequestInfo(url, "POST", {}, url), (),
+                                       status={"rejected": 400, "unavailable": 503, "rate_limited": 429}[kind],
+                                       message=f"injected {what} failure ({kind})")
+
+
+def fake_vector(text, dimension=EMBEDDING_DIMENSION):
+    """Deterministic unit vector for a text, so identical inputs embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbedder:
+    def __init__(self, latency=0.05, per_item_latency=0.0005, failure_rate=0.0, dimension=EMBEDDING_DIMENSION,
+                 fatal_share=0.0):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.failure_rate = failure_rate
+        self.fatal_share = fatal_share
+        self.dimension = dimension
+        self.calls = 0
+        self.items = 0
+
+    async def embed_batch(self, texts):
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.per_item_latency * len(texts))
+        if random.random() < self.failure_rate:
+            raise openai_error("embedding", self.fatal_share)
+        self.items += len(texts)
+        return [fake_vector(text, self.dimension) for text in texts]
+
+    async def embed(self, text):
+        return (await self.embed_batch([text]))[0]
+
+    async def create(self, input, engine=None):
+        """Same call and response shape as async_clients.embedding_create."""
+        texts = [input] if isinstance(input, str) else list(input)
+        vectors = await self.embed_batch(texts)
+        return {"data": [{"index": index, "embedding": vector} for index, vector in enumerate(vectors)]}
+
+
+class FakeIndex:
+    def __init__(self, latency=0.03, per_item_latency=0.0001, failure_rate=0.0, fatal_share=0.0):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.failure_rate = failure_rate
+        self.fatal_share = fatal_share
+        self.calls = 0
+        self.namespaces = {}
+
+    async def upsert(self, vectors, namespace):
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.per_item_latency * len(vectors))
+        if random.random() < self.failure_rate:
+            raise index_error("upsert", self.fatal_share)
+        self.namespaces.setdefault(namespace, {}).update(vectors)
+
+    def count(self, namespace):
+        return len(self.namespaces.get(namespace, {}))
+
+
+class FakeVectorStore(FakeIndex):
+    """FakeIndex with the VectorStore async interface and brute-force cosine queries."""
+
+    def __init__(self, latency=0.03, per_item_latency=0.0001, failure_rate=0.0, fatal_share=0.0):
+        super().__init__(latency, per_item_latency, failure_rate, fatal_share)
+        self.queries = 0
+        self._matrices = {}
+
+    async def aupsert(self, vectors, namespace):
+        await self.upsert(vectors, namespace)
+        self._matrices.pop(namespace, None)
+
+    async def aquery(self, vector, top_k, namespace):
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise index_error("query", self.fatal_share)
+        vectors = self.namespaces.get(namespace)
+        if not vectors:
+            return []
+        if namespace not in self._matrices:
+            self._matrices[namespace] = (list(vectors), np.array(list(vectors.values()), dtype=np.float32))
+        ids, matrix = self._matrices[namespace]
+        scores = matrix @ np.asarray(vector, dtype=np.float32)
+        best = np.argsort(-scores)[:top_k]
+        return [(ids[i], float(scores[i])) for i in best]
+
+
+class FakeCompletion:
+    """Stands in for openai.ChatCompletion: a reply of `tokens` tokens, with or without streaming."""
+
+    def __init__(self, first_token_latency=0.4, token_latency=0.03, tokens=150, failure_rate=0.0, fatal_share=0.0):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.fatal_share = fatal_share
+        self.calls = 0
+        self.prompt_messages = 0
+
+    def _reply_tokens(self):
+        return [f"word{i} " for i in range(self.tokens)]
+
+    async def acreate(self, stream=False, **kwargs):
+        self.calls += 1
+        self.prompt_messages += len(kwargs.get("messages", []))
+        if random.random() < self.failure_rate:
+            await asyncio.sleep(self.first_token_latency)
+            raise openai_error("completion", self.fatal_share)
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.first_token_latency + self.token_latency * self.tokens)
+        return {"choices": [{"message": {"role": "assistant", "content": "".join(self._reply_tokens())}}],
+                "usage": {"prompt_tokens": messages_tokens(kwargs.get("messages", [])),
+                          "completion_tokens": self.tokens}}
+
+    async def _stream(self):
+        await asyncio.sleep(self.first_token_latency)
+        yield {"choices": [{"delta": {"role": "assistant"}}]}
+        for token in self._reply_tokens():
+            yield {"choices": [{"delta": {"content": token}}]}
+            await asyncio.sleep(self.token_latency)
+        yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        await asyncio.sleep(self.channel.latency)
+        self.channel.edits += 1
+        self.content = content
+
+
+class FakeChannel:
+    """Collects sent messages and counts edits, with a fixed per-call latency."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.messages = []
+        self.edits = 0
+
+    async def send(self, content):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        return message
+
+    def typing(self):
+        return _NullTyping()
+
+
+class _NullTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
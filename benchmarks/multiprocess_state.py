@@ -0,0 +1,153 @@
+# --------------------
+# Multi-process shared state check
+# --------------------
+# Run from the repo root: python -m benchmarks.multiprocess_state
+# Starts several worker processes against one SqliteSharedStore, the way
+# launcher.py runs the bot, and checks what the workers have to agree on:
+# a !sleep in one worker is seen by the others, each user can claim only one
+# conversation, sessions written by one worker are read by another, and the
+# shared request queue runs every request exactly once, never two at a time
+# for the same user, spread over the workers. Exits non-zero on failure.
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import multiprocessing
+
+from shared_state import SqliteSharedStore
+from session_manager import SessionManager
+from request_scheduler import SharedQueueScheduler
+
+WORKERS = 4
+USERS = 50
+REQUESTS_PER_WORKER = 100
+HANDLER_LATENCY = 0.02
+FLAG_CACHE_TTL = 0.2
+
+
+def claim_conversations(path, worker, start, results):
+    store = SqliteSharedStore(path)
+    start.wait()
+    results.put(("claims", worker, [user_id for user_id in range(USERS) if store.claim_conversation(user_id, worker)]))
+
+
+def run_worker(path, worker, start, results):
+    store = SqliteSharedStore(path, flag_cache_ttl=FLAG_CACHE_TTL)
+    start.wait()
+
+    async def handler(user_id, content):
+        started = time.time()
+        await asyncio.sleep(HANDLER_LATENCY * random.random())
+        return {"worker": worker, "user_id": user_id, "content": content, "started": started, "ended": time.time()}
+
+    async def main():
+        scheduler = SharedQueueScheduler(handler, store, worker, workers=8, poll_interval=0.01)
+        scheduler.start()
+        rng = random.Random(worker)
+        started = time.monotonic()
+        futures = [await scheduler.submit(rng.randrange(USERS), f"{worker}-{i}") for i in range(REQUESTS_PER_WORKER)]
+        responses = await asyncio.gather(*futures)
+        elapsed = time.monotonic() - started
+        # Keep serving other workers' requests until the queue is drained
+        while store.queue_depth():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        await scheduler.stop()
+        return responses, elapsed
+
+    responses, elapsed = asyncio.run(main())
+    results.put(("requests", worker, (responses, elapsed)))
+
+    # Worker 0 goes to sleep; everyone else must notice within the flag cache TTL
+    if worker == 0:
+        store.set_flag("bot_sleeping", True)
+        sessions = SessionManager(store=store)
+        sessions.append("shared-user", "user", "hello from worker 0")
+        results.put(("flag", worker, 0.0))
+    else:
+        waited = time.monotonic()
+        while not store.get_flag("bot_sleeping") and time.monotonic() - waited < 5:
+            time.sleep(0.01)
+        results.put(("flag", worker, time.monotonic() - waited if store.get_flag("bot_sleeping") else None))
+
+
+def collect(processes, results, expected):
+    collected = [results.get(timeout=120) for _ in range(expected)]
+    for process in processes:
+        process.join()
+    return collected
+
+
+def main():
+    failures = []
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "shared_state.db")
+    SqliteSharedStore(path)  # create the schema before the workers race for it
+
+    # Conversation claims
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=claim_conversations, args=(path, worker, start, results))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    start.set()
+    claimed = [user_id for _, _, user_ids in collect(processes, results, WORKERS) for user_id in user_ids]
+    print(f"conversation claims: {len(claimed)} granted for {USERS} users from {WORKERS} workers")
+    if sorted(claimed) != list(range(USERS)):
+        failures.append("conversation claimed more than once or not at all")
+
+    # Request queue, flags and sessions
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_worker, args=(path, worker, start, results))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    start.set()
+    collected = collect(processes, results, WORKERS * 2)
+
+    request_results = [value for kind, _, value in collected if kind == "requests"]
+    responses = [response for worker_responses, _ in request_results for response in worker_responses]
+    elapsed = max(worker_elapsed for _, worker_elapsed in request_results)
+    served_by = {}
+    for response in responses:
+        served_by[response["worker"]] = served_by.get(response["worker"], 0) + 1
+    print(f"shared queue: {len(responses)} requests in {elapsed:.2f}s "
+          f"({len(responses) / elapsed:.0f}/s), served per worker {dict(sorted(served_by.items()))}")
+    if len(responses) != WORKERS * REQUESTS_PER_WORKER:
+        failures.append("requests lost")
+    if len({response["content"] for response in responses}) != len(responses):
+        failures.append("request run more than once")
+    if len(served_by) < 2:
+        failures.append("requests were not spread over workers")
+    by_user = {}
+    for response in responses:
+        by_user.setdefault(response["user_id"], []).append((response["started"], response["ended"]))
+    overlaps = sum(1 for intervals in by_user.values()
+                   for (_, ended), (started, _) in zip(sorted(intervals), sorted(intervals)[1:]) if started < ended)
+    print(f"overlapping requests for the same user: {overlaps}")
+    if overlaps:
+        failures.append("a user had two requests running at once")
+
+    delays = [delay for kind, worker, delay in collected if kind == "flag" and worker != 0]
+    print(f"sleep flag seen by other workers: {sum(delay is not None for delay in delays)}/{len(delays)}, "
+          f"slowest after {max(delay or 0 for delay in delays):.2f}s")
+    if None in delays:
+        failures.append("sleep flag did not propagate")
+
+    session = SessionManager(store=SqliteSharedStore(path)).messages("shared-user")
+    print(f"session written by worker 0 read back: {session}")
+    if session != [{"role": "user", "content": "hello from worker 0"}]:
+        failures.append("session not shared")
+
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+# --------------------
+# Offline replay benchmark
+# --------------------
+# Run from the repo root: python -m benchmarks.replay [--corpus chat_logs] [--json out.json]
+# Replays conversations through the real message pipeline (pipeline.ChatPipeline:
+# sessions, request scheduler, retrieval, completion with retries, saving and
+# indexing) with the fake Discord, embedding, completion and index backends
+# from benchmarks/fakes.py, each with configurable latency. Every simulated
+# user opens a chat (!chat), sends their messages with a think time in
+# between, then ends it (!end) so the conversation is saved and indexed; the
+# run ends by draining the write-behind queue, as the bot does on shutdown.
+#
+# The corpus is a chat_logs-shaped folder (<user_id>/<uuid>.json segments);
+# the user messages in each folder become that user's script. Without
+# --corpus a synthetic one is generated. The corpus is copied into a scratch
+# folder first, so it is never modified, and pre-indexed in the fake vector
+# store so retrieval has something to find.
+#
+# Reports throughput, reply latency percentiles, memory and file I/O. With
+# --baseline, exits non-zero when throughput or p99 latency regress by more
+# than --tolerance against an earlier --json result, for CI.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import async_clients
+import segment_index
+from chat_store import (JsonFileChatStore, SqliteChatStore, split_segments, migrate_json_to_sqlite, iter_chat_log_files,
+                        save_order)
+from embedding_cache import EmbeddingCache
+from pipeline import ChatPipeline
+from benchmarks.fakes import FakeEmbedder, FakeVectorStore, FakeCompletion, FakeChannel, fake_vector
+
+WORDS = ("bear", "honey", "market", "token", "chart", "moon", "wallet", "block", "chain", "trade", "yield", "pump")
+PROMPT_PARAMETERS = {
+    "model": "gpt-3.5-turbo",
+    "messages": [{"role": "system", "content": "You are Bearsworth, a helpful crypto bear."}],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay conversations through the message pipeline with fake backends.")
+    parser.add_argument("--corpus", help="chat_logs-shaped folder to replay (default: generate a synthetic one)")
+    parser.add_argument("--users", type=int, default=100, help="users to replay (synthetic corpus size, or a cap)")
+    parser.add_argument("--turns", type=int, default=4, help="messages each user sends")
+    parser.add_argument("--history-segments", type=int, default=3, help="saved segments per synthetic user")
+    parser.add_argument("--think-time", type=float, default=0.2, help="mean seconds between a reply and the next message")
+    parser.add_argument("--store", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--stream", action="store_true", help="stream replies as progressively edited messages")
+    parser.add_argument("--workers", type=int, default=30, help="request scheduler workers")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--index-latency", type=float, default=0.03)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--discord-latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="injected failure rate for every backend")
+    parser.add_argument("--fatal-share", type=float, default=0.0,
+                        help="share of injected failures that are rejected requests rather than outages or rate limits")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="earlier --json results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression against the baseline")
+    return parser.parse_args(argv)
+
+
+# --------------------
+# Corpus
+# --------------------
+def synthetic_corpus(folder, users, segments_per_user, rng):
+    store = JsonFileChatStore(folder)
+    for user_id in range(1, users + 1):
+        history = []
+        for _ in range(segments_per_user * 5):
+            history.append({"role": "user", "content": " ".join(rng.choices(WORDS, k=rng.randint(5, 25)))})
+            history.append({"role": "assistant", "content": " ".join(rng.choices(WORDS, k=rng.randint(20, 80)))})
+        store.save_segments(user_id, split_segments(history[:segments_per_user * 10]))
+
+
+def read_corpus(folder):
+    """Return {user_id: [segment records]} for every <user>/<uuid>.json segment in folder."""
+    users = {}
+    for _, record in sorted(iter_chat_log_files(folder)):
+        users.setdefault(record["metadata"]["user_id"], []).append(record)
+    for records in users.values():
+        records.sort(key=save_order)
+    return users
+
+
+def scripts_from_corpus(corpus, turns, max_users):
+    scripts = {}
+    for user_id, records in list(corpus.items())[:max_users]:
+        messages = [message["content"] for record in records for message in record["chat_history"]
+                    if message["role"] == "user"]
+        if messages:
+            scripts[user_id] = messages[-turns:]
+    return scripts
+
+
+# --------------------
+# I/O accounting
+# --------------------
+class FileOpenCounter:
+    # Counts files opened under the corpus folder. Audit hooks can't be removed, so this one is
+    # installed once and only counts while enabled.
+    def __init__(self, folder):
+        self.folder = os.path.realpath(folder)
+        self.reads = 0
+        self.writes = 0
+        self.sqlite_connects = 0
+        self.enabled = False
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if not self.enabled:
+            return
+        if event == "open" and isinstance(args[0], str) and os.path.realpath(args[0]).startswith(self.folder):
+            mode = args[1] or "r"
+            if any(flag in mode for flag in "wax+"):
+                self.writes += 1
+            else:
+                self.reads += 1
+        elif event == "sqlite3.connect":
+            self.sqlite_connects += 1
+
+
+def proc_io():
+    """This process's I/O counters from /proc (Linux), including reads and writes made by SQLite."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f.read().splitlines())}
+    except OSError:
+        return {}
+
+
+def prepare_store(store, work_folder):
+    """Open the chat store over the copied corpus, importing or indexing it first as the bot's tools would."""
+    if store == "sqlite":
+        migrate_json_to_sqlite(work_folder)
+        return SqliteChatStore(os.path.join(work_folder, "chat_logs.db"))
+    segment_index.rebuild_index(work_folder)
+    return JsonFileChatStore(work_folder)
+
+
+# --------------------
+# Replay
+# --------------------
+async def replay(args, chat_store, work_folder, scripts, corpus):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    embedder = FakeEmbedder(latency=args.embed_latency, failure_rate=args.failure_rate, fatal_share=args.fatal_share)
+    index = FakeVectorStore(latency=args.index_latency, failure_rate=args.failure_rate, fatal_share=args.fatal_share)
+    completion = FakeCompletion(first_token_latency=args.first_token_latency, token_latency=args.token_latency,
+                                tokens=args.reply_tokens, failure_rate=args.failure_rate, fatal_share=args.fatal_share)
+
+    # Pre-index the corpus so retrieval finds earlier conversations, as it would in production
+    index.namespaces["convo-logs"] = {
+        record["metadata"]["unique_id"]: fake_vector(" ".join(message["content"] for message in record["chat_history"]))
+        for records in corpus.values() for record in records}
+
+    pipeline = ChatPipeline(chat_store, index, EmbeddingCache(capacity=10000), PROMPT_PARAMETERS,
+                            embedding_create=embedder.create, chat_completion_create=completion.acreate,
+                            max_concurrent_requests=args.workers, stream_responses=args.stream,
+                            write_behind_path=os.path.join(work_folder, "write_behind.wal"))
+    pipeline.start()
+
+    latencies = []
+    saves = []
+
+    async def conversation(user_id, script):
+        channel = FakeChannel(latency=args.discord_latency)
+        await asyncio.sleep(rng.random() * args.think_time * 2)  # users don't all arrive at once
+        # !chat: load the history into the session, as the chat command and on_message do
+        if not await pipeline.sessions.amessages(user_id):
+            await pipeline.load_chat_history(user_id)
+        await pipeline.sessions.aset_history(user_id, await pipeline.load_recent_messages(user_id))
+        for content in script:
+            started = time.perf_counter()
+            await pipeline.handle_message(channel, user_id, content)
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time else 0)
+        # !end: log the conversation; saving and indexing carry on in the background
+        started = time.perf_counter()
+        await pipeline.end_conversation(user_id)
+        saves.append(time.perf_counter() - started)
+        return channel
+
+    started = time.perf_counter()
+    channels = await asyncio.gather(*(conversation(user_id, script) for user_id, script in scripts.items()))
+    elapsed = time.perf_counter() - started
+    drain_started = time.perf_counter()
+    await pipeline.stop()
+    drain = time.perf_counter() - drain_started
+    unsaved = len(pipeline.write_behind)
+    await async_clients.close()
+
+    apologies = sum(1 for channel in channels for message in channel.messages
+                    if message.content.startswith("I'm sorry, there was an issue"))
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "saves": saves,
+        "drain": drain,
+        "unsaved": unsaved,
+        "apologies": apologies,
+        "edits": sum(channel.edits for channel in channels),
+        "embedding_calls": embedder.calls,
+        "completion_calls": completion.calls,
+        "upsert_calls": index.calls,
+        "vector_queries": index.queries,
+        "retries": sum(pipeline.retry_policy.retries.values()),
+    }
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    scratch = tempfile.mkdtemp(prefix="replay-")
+    work_folder = os.path.join(scratch, "chat_logs")
+    try:
+        if args.corpus:
+            shutil.copytree(args.corpus, work_folder,
+                            ignore=shutil.ignore_patterns("*.db", "*.db-wal", "*.db-shm"))
+        else:
+            synthetic_corpus(work_folder, args.users, args.history_segments, rng)
+        corpus = read_corpus(work_folder)
+        scripts = scripts_from_corpus(corpus, args.turns, args.users)
+        if not scripts:
+            print("No user messages found in the corpus")
+            return 1
+
+        chat_store = prepare_store(args.store, work_folder)
+
+        counter = FileOpenCounter(work_folder)
+        if args.tracemalloc:
+            tracemalloc.start()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        io_before = proc_io()
+        counter.enabled = True
+        result = asyncio.run(replay(args, chat_store, work_folder, scripts, corpus))
+        counter.enabled = False
+        io_after = proc_io()
+        heap_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    latencies = result["latencies"]
+    report = {
+        "users": len(scripts),
+        "messages": len(latencies),
+        "store": args.store,
+        "stream": args.stream,
+        "elapsed_s": round(result["elapsed"], 3),
+        "throughput_msg_s": round(len(latencies) / result["elapsed"], 2),
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p95_s": round(percentile(latencies, 95), 4),
+        "latency_p99_s": round(percentile(latencies, 99), 4),
+        "latency_max_s": round(max(latencies, default=0.0), 4),
+        "end_p99_s": round(percentile(result["saves"], 99), 4),
+        "drain_s": round(result["drain"], 3),
+        "unsaved_conversations": result["unsaved"],
+        "failed_replies": result["apologies"],
+        "retries": result["retries"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+        "heap_peak_mb": round(heap_peak / 2**20, 1) if heap_peak is not None else None,
+        "file_opens_read": counter.reads,
+        "file_opens_write": counter.writes,
+        "sqlite_connects": counter.sqlite_connects,
+        "read_syscalls": io_after.get("syscr", 0) - io_before.get("syscr", 0),
+        "write_syscalls": io_after.get("syscw", 0) - io_before.get("syscw", 0),
+        "bytes_read": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+        "bytes_written": io_after.get("wchar", 0) - io_before.get("wchar", 0),
+        "embedding_calls": result["embedding_calls"],
+        "completion_calls": result["completion_calls"],
+        "vector_queries": result["vector_queries"],
+        "upsert_calls": result["upsert_calls"],
+        "message_edits": result["edits"],
+    }
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key:<{width}} {value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        mismatched = [key for key in ("users", "messages", "store", "stream") if baseline.get(key) != report[key]]
+        if mismatched:
+            print(f"Baseline was recorded with different settings ({', '.join(mismatched)}), not comparing")
+            return 1
+        regressions = []
+        if report["throughput_msg_s"] < baseline["throughput_msg_s"] * (1 - args.tolerance):
+            regressions.append(f"throughput {report['throughput_msg_s']} < baseline {baseline['throughput_msg_s']}")
+        if report["latency_p99_s"] > baseline["latency_p99_s"] * (1 + args.tolerance):
+            regressions.append(f"p99 latency {report['latency_p99_s']}s > baseline {baseline['latency_p99_s']}s")
+        if regressions:
+            print("REGRESSION: " + "; ".join(regressions))
+            return 1
+        print(f"Within {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+# --------------------
+# Chat log store
+# --------------------
+# Pluggable storage for saved conversation segments. The "json" backend keeps
+# the original chat_logs/<user>/<uuid>.json layout; the "sqlite" backend keeps
+# every segment in one database indexed by user and save order, so "last N
+# messages" is a single indexed range scan instead of a folder walk.
+import os
+import sys
+import json
+import time
+import sqlite3
+import datetime
+import threading
+import uuid as uuid_lib
+
+import segment_index
+
+SEGMENT_SIZE = 3
+
+
+def split_segments(chat_history, segment_size=SEGMENT_SIZE):
+    return [chat_history[i:i + segment_size] for i in range(0, len(chat_history), segment_size)]
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def save_order(chat_log):
+    """Sort key putting segment files in the order they were saved."""
+    metadata = chat_log["metadata"]
+    return metadata["timestamp"], metadata.get("seq", 0)
+
+
+def iter_chat_log_files(chat_logs_folder="chat_logs"):
+    """Yield (file_path, chat_log) for every <user>/<uuid>.json segment under the folder, skipping unreadable ones."""
+    for root, _, files in os.walk(chat_logs_folder):
+        for file in files:
+            if not file.endswith(".json"):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                with open(file_path, "r") as f:
+                    chat_log = json.load(f)
+                missing = {"unique_id", "user_id", "timestamp"} - chat_log["metadata"].keys()
+                if missing or "chat_history" not in chat_log:
+                    raise KeyError(", ".join(sorted(missing)) or "chat_history")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Skipping unreadable chat log {file_path}: {e}")
+                continue
+            yield file_path, chat_log
+
+
+class ChatStore:
+    def save_segments(self, user_id, segments, unique_ids=None):
+        """Persist segments for a user and return their (unique_id, segment) pairs in save order.
+
+        Saving again with the same unique_ids (e.g. a save repeated after a crash) doesn't add copies."""
+        raise NotImplementedError
+
+    def load_history(self, user_id):
+        """Return every saved message for a user, oldest first."""
+        raise NotImplementedError
+
+    def recent_messages(self, user_id, num_messages=10):
+        """Return the user's last num_messages saved messages, oldest first."""
+        raise NotImplementedError
+
+    def get_segments(self, unique_ids):
+        """Return {unique_id: chat_history} for the ids that exist."""
+        raise NotImplementedError
+
+
+class JsonFileChatStore(ChatStore):
+    # Each user folder keeps a manifest listing "<seq> <unique_id>" per line in save order, so
+    # segments can be ordered (and the newest found) without opening every segment file.
+    MANIFEST_FILE = "manifest.txt"
+
+    def __init__(self, chat_logs_folder="chat_logs"):
+        self.chat_logs_folder = chat_logs_folder
+
+    def _user_folder(self, user_id):
+        return os.path.join(self.chat_logs_folder, str(user_id))
+
+    def _manifest_path(self, user_id):
+        return os.path.join(self._user_folder(user_id), self.MANIFEST_FILE)
+
+    def _read_manifest(self, user_id):
+        """Return [(seq, unique_id)] for the user in save order, building the manifest for legacy folders."""
+        manifest_path = self._manifest_path(user_id)
+        if not os.path.exists(manifest_path):
+            return self._build_manifest(user_id)
+        entries = []
+        with open(manifest_path, "r") as manifest:
+            for line in manifest:
+                parts = line.split()
+                if len(parts) == 2:
+                    entries.append((int(parts[0]), parts[1]))
+        return entries
+
+    def _build_manifest(self, user_id):
+        # Folders written before the manifest existed: parse each file once, order by the saved
+        # timestamp (file mtime breaks ties between segments saved in the same second)
+        user_folder = self._user_folder(user_id)
+        if not os.path.isdir(user_folder):
+            return []
+        found = [(*save_order(chat_log), os.path.getmtime(file_path), chat_log["metadata"]["unique_id"])
+                 for file_path, chat_log in iter_chat_log_files(user_folder)]
+        found.sort()
+        entries = [(seq, unique_id) for seq, (_, _, _, unique_id) in enumerate(found, start=1)]
+        # Another thread or process may be building the same manifest. Write it aside and link it into
+        # place, which fails if a manifest exists by then; in that case use the one that got there first
+        manifest_path = self._manifest_path(user_id)
+        temp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, "w") as manifest:
+            manifest.write("".join(f"{seq} {unique_id}\n" for seq, unique_id in entries))
+        try:
+            os.link(temp_path, manifest_path)
+        except FileExistsError:
+            return self._read_manifest(user_id)
+        finally:
+            os.remove(temp_path)
+        return entries
+
+    def _last_seq(self, user_id):
+        manifest_path = self._manifest_path(user_id)
+        if not os.path.exists(manifest_path):
+            entries = self._build_manifest(user_id)
+            return entries[-1][0] if entries else 0
+        # Only the tail of the manifest is needed to find the last sequence number
+        with open(manifest_path, "rb") as manifest:
+            manifest.seek(0, os.SEEK_END)
+            manifest.seek(max(0, manifest.tell() - 4096))
+            lines = manifest.read().split(b"\n")
+        for line in reversed(lines):
+            parts = line.split()
+            if len(parts) == 2:
+                return int(parts[0])
+        return 0
+
+    def _append_manifest(self, user_id, entries):
+        with open(self._manifest_path(user_id), "a") as manifest:
+            manifest.write("".join(f"{seq} {unique_id}\n" for seq, unique_id in entries))
+
+    def save_segments(self, user_id, segments, unique_ids=None):
+        user_folder = self._user_folder(user_id)
+        os.makedirs(user_folder, exist_ok=True)
+        formatted_timestamp = format_timestamp(int(time.time()))
+        unique_ids = unique_ids or [str(uuid_lib.uuid4()) for _ in segments]
+        # Segments already listed in the manifest are rewritten in place rather than listed twice
+        known = {}
+        if any(os.path.exists(os.path.join(user_folder, f"{unique_id}.json")) for unique_id in unique_ids):
+            known = {unique_id: seq for seq, unique_id in self._read_manifest(user_id)}
+        next_seq = self._last_seq(user_id) + 1
+
+        saved = []
+        records = []
+        entries = []
+        for segment, unique_id in zip(segments, unique_ids):
+            seq = known.get(unique_id)
+            if seq is None:
+                seq = next_seq
+                next_seq += 1
+                entries.append((seq, unique_id))
+            segmented_chat_log = {
+                "metadata": {
+                    "timestamp": formatted_timestamp,
+                    "unique_id": unique_id,
+                    "user_id": user_id,
+                    "seq": seq,
+                },
+                "chat_history": segment,
+            }
+            file_path = os.path.join(user_folder, f"{unique_id}.json")
+            with open(file_path, "w") as file:
+                json.dump(segmented_chat_log, file, indent=4)
+            records.append((unique_id, user_id, file_path, segment))
+            saved.append((unique_id, segment))
+        self._append_manifest(user_id, entries)
+        segment_index.add_segments(records, self.chat_logs_folder)
+        return saved
+
+    def _read_segment(self, user_id, unique_id):
+        chat_file = os.path.join(self._user_folder(user_id), f"{unique_id}.json")
+        try:
+            with open(chat_file, "r") as file:
+                segmented_chat_log = json.load(file)
+        except FileNotFoundError:
+            print(f"Chat history file not found for user {user_id} with file {chat_file}.")
+            return []
+        if segmented_chat_log["metadata"]["user_id"] != user_id:
+            return []
+        return segmented_chat_log["chat_history"]
+
+    def load_history(self, user_id):
+        history = []
+        for _, unique_id in self._read_manifest(user_id):
+            history.extend(self._read_segment(user_id, unique_id))
+        return history
+
+    def recent_messages(self, user_id, num_messages=10):
+        # Walk the manifest newest first and stop as soon as enough messages are loaded
+        recent = []
+        for _, unique_id in reversed(self._read_manifest(user_id)):
+            recent = self._read_segment(user_id, unique_id) + recent
+            if len(recent) >= num_messages:
+                break
+        return recent[-num_messages:]
+
+    def get_segments(self, unique_ids):
+        indexed = segment_index.lookup_segments(unique_ids, self.chat_logs_folder)
+        segments = {unique_id: record["chat_history"] for unique_id, record in indexed.items()}
+        for unique_id in unique_ids:
+            if unique_id in segments:
+                continue
+            # Not indexed yet (e.g. written before the index existed), fall back to a folder scan
+            file_path = segment_index.find_segment_file(unique_id, self.chat_logs_folder)
+            if file_path is None:
+                continue
+            with open(file_path, "r") as f:
+                chat_log = json.load(f)
+            segment_index.add_segment(unique_id, chat_log["metadata"]["user_id"], file_path,
+                                      chat_log["chat_history"], self.chat_logs_folder)
+            segments[unique_id] = chat_log["chat_history"]
+        return segments
+
+
+class SqliteChatStore(ChatStore):
+    def __init__(self, db_path=os.path.join("chat_logs", "chat_logs.db")):
+        self.db_path = db_path
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "unique_id TEXT NOT NULL UNIQUE, "
+            "user_id TEXT NOT NULL, "
+            "timestamp TEXT NOT NULL, "
+            "chat_history TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS segments_user_seq ON segments (user_id, seq)")
+        self._conn.commit()
+
+    def insert_segments(self, rows):
+        """Insert (unique_id, user_id, timestamp, chat_history) rows in order, skipping known ids."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO segments (unique_id, user_id, timestamp, chat_history) VALUES (?, ?, ?, ?)",
+                [(unique_id, str(user_id), timestamp, json.dumps(chat_history))
+                 for unique_id, user_id, timestamp, chat_history in rows],
+            )
+            self._conn.commit()
+
+    def save_segments(self, user_id, segments, unique_ids=None):
+        formatted_timestamp = format_timestamp(int(time.time()))
+        unique_ids = unique_ids or [str(uuid_lib.uuid4()) for _ in segments]
+        # Known ids are skipped by insert_segments, so a repeated save adds nothing
+        saved = list(zip(unique_ids, segments))
+        self.insert_segments([(unique_id, user_id, formatted_timestamp, segment) for unique_id, segment in saved])
+        return saved
+
+    def load_history(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_history FROM segments WHERE user_id = ? ORDER BY seq", (str(user_id),)
+            ).fetchall()
+        history = []
+        for (chat_history,) in rows:
+            history.extend(json.loads(chat_history))
+        return history
+
+    def recent_messages(self, user_id, num_messages=10):
+        recent = []
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT chat_history FROM segments WHERE user_id = ? ORDER BY seq DESC", (str(user_id),)
+            )
+            for (chat_history,) in cursor:
+                recent = json.loads(chat_history) + recent
+                if len(recent) >= num_messages:
+                    break
+            cursor.close()
+        return recent[-num_messages:]
+
+    def get_segments(self, unique_ids):
+        unique_ids = list(unique_ids)
+        if not unique_ids:
+            return {}
+        placeholders = ",".join("?" * len(unique_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT unique_id, chat_history FROM segments WHERE unique_id IN ({placeholders})", unique_ids
+            ).fetchall()
+        return {unique_id: json.loads(chat_history) for unique_id, chat_history in rows}
+
+
+def get_chat_store(backend=None, chat_logs_folder="chat_logs"):
+    backend = backend or os.environ.get("CHAT_STORE", "json")
+    if backend == "json":
+        return JsonFileChatStore(chat_logs_folder)
+    if backend == "sqlite":
+        return SqliteChatStore(os.path.join(chat_logs_folder, "chat_logs.db"))
+    raise ValueError(f"Unknown chat store backend: {backend}")
+
+
+def migrate_json_to_sqlite(chat_logs_folder="chat_logs", db_path=None, batch_size=1000):
+    """Import an existing chat_logs/<user>/<uuid>.json tree into a SqliteChatStore. Safe to re-run."""
+    store = SqliteChatStore(db_path or os.path.join(chat_logs_folder, "chat_logs.db"))
+    # Insert oldest first so seq order matches the original save order
+    chat_logs = sorted((chat_log for _, chat_log in iter_chat_log_files(chat_logs_folder)), key=save_order)
+    rows = [(chat_log["metadata"]["unique_id"], chat_log["metadata"]["user_id"], chat_log["metadata"]["timestamp"],
+             chat_log["chat_history"]) for chat_log in chat_logs]
+    for i in range(0, len(rows), batch_size):
+        store.insert_segments(rows[i:i + batch_size])
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("usage: python chat_store.py migrate [chat_logs_folder] [db_path]")
+        sys.exit(1)
+    folder = sys.argv[2] if len(sys.argv) > 2 else "chat_logs"
+    db_path = sys.argv[3] if len(sys.argv) > 3 else None
+    print(f"Imported {migrate_json_to_sqlite(folder, db_path)} segments from {folder}")
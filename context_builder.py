@@ -0,0 +1,84 @@
+# --------------------
+# Context builder
+# --------------------
+# Assembles the message list sent to ChatCompletion within a token budget.
+# The system prompt and the new user message always go in; the most recent
+# history is kept next, newest first; retrieved segments fill whatever budget
+# is left in relevance order, skipping any message already in the prompt.
+from functools import lru_cache
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:  # fall back to a character-based estimate
+    _encoding = None
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators added per message by the chat format
+REPLY_PRIMING_TOKENS = 3
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"])
+
+
+def messages_tokens(messages):
+    return REPLY_PRIMING_TOKENS + sum(message_tokens(message) for message in messages)
+
+
+def _message_key(message):
+    return message["role"], message["content"].strip()
+
+
+def build_context(system_messages, relevant_segments, recent_messages, user_message, budget):
+    """Return (messages, stats) with system + relevant + recent + user fitted into `budget` tokens.
+
+    relevant_segments is a list of retrieved segments (each a list of messages), best match first.
+    """
+    used = messages_tokens(system_messages) + message_tokens(user_message)
+    seen = {_message_key(user_message)}
+
+    # Recent history, newest first, stopping at the first message that doesn't fit so it stays contiguous
+    kept_recent = []
+    for message in reversed(recent_messages):
+        key = _message_key(message)
+        if key in seen:
+            continue
+        tokens = message_tokens(message)
+        if used + tokens > budget:
+            break
+        used += tokens
+        seen.add(key)
+        kept_recent.append(message)
+    kept_recent.reverse()
+
+    # Retrieved segments in rank order, dropping messages already present
+    kept_relevant = []
+    duplicates = 0
+    for segment in relevant_segments:
+        for message in segment:
+            key = _message_key(message)
+            if key in seen:
+                duplicates += 1
+                continue
+            tokens = message_tokens(message)
+            if used + tokens > budget:
+                continue
+            used += tokens
+            seen.add(key)
+            kept_relevant.append(message)
+
+    messages = system_messages + kept_relevant + kept_recent + [user_message]
+    stats = {
+        "tokens": used,
+        "duplicates": duplicates,
+        "dropped_recent": len(recent_messages) - len(kept_recent),
+        "dropped_relevant": sum(len(segment) for segment in relevant_segments) - len(kept_relevant) - duplicates,
+    }
+    return messages, stats
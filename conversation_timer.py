@@ -0,0 +1,92 @@
+# --------------------
+# Conversation inactivity timer
+# --------------------
+# One background task tracks the inactivity deadline of every open
+# conversation in a heap keyed by deadline. Activity pushes a deadline back;
+# refreshed or cancelled entries are left in the heap and skipped when they
+# surface. Whenever deadlines pass, every expired conversation is handed to
+# on_expire as one batch, so the number of tasks stays the same however many
+# threads are open.
+import time
+import heapq
+import asyncio
+
+
+class InactivityTimer:
+    def __init__(self, on_expire, timeout=15 * 60, max_sleep=60):
+        self.on_expire = on_expire
+        self.timeout = timeout
+        self.max_sleep = max_sleep
+        self._deadlines = {}
+        self._channels = {}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __contains__(self, user_id):
+        return user_id in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def add(self, user_id, channel):
+        """Start tracking a conversation."""
+        self._channels[user_id] = channel
+        self._schedule(user_id)
+
+    def refresh(self, user_id):
+        """Push a tracked conversation's deadline back after activity."""
+        if user_id in self._deadlines:
+            self._schedule(user_id)
+
+    def cancel(self, user_id):
+        self._deadlines.pop(user_id, None)
+        self._channels.pop(user_id, None)
+
+    def _schedule(self, user_id):
+        deadline = time.monotonic() + self.timeout
+        self._deadlines[user_id] = deadline
+        heapq.heappush(self._heap, (deadline, user_id))
+        # Only wake the loop if this deadline is now the earliest one
+        if self._heap[0][1] == user_id and self._heap[0][0] == deadline:
+            self._wakeup.set()
+
+    def _pop_expired(self, now):
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._heap)
+            if self._deadlines.get(user_id) != deadline:
+                continue  # refreshed or cancelled since this entry was pushed
+            del self._deadlines[user_id]
+            expired.append((user_id, self._channels.pop(user_id, None)))
+        # Drop stale entries at the top so the next sleep is computed from a live deadline
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return expired
+
+    async def _run(self):
+        while True:
+            expired = self._pop_expired(time.monotonic())
+            if expired:
+                try:
+                    await self.on_expire(expired)
+                except Exception as e:
+                    print(f"Error occurred while ending inactive conversations: {e}")
+                continue
+            delay = self.max_sleep
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - time.monotonic()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,188 @@
+# --------------------
+# Embedding cache
+# --------------------
+# Content-hash keyed cache for embeddings: a bounded in-memory LRU in front of
+# an optional on-disk store. The disk store is an append-only float32 matrix
+# (vectors.f32, read through a memory map) plus a keys file mapping each
+# content hash to its row, so cached vectors survive restarts. Worker
+# processes can share one cache directory: appends hold an exclusive lock on
+# the vector file. The async methods keep the disk reads and appends off the
+# event loop.
+import os
+import json
+import fcntl
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from async_clients import run_blocking
+
+
+def content_key(content, engine):
+    return hashlib.sha256(f"{engine}\0{content}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, capacity=10000, cache_dir=None):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._rows = {}
+        self._dimension = None
+        self._matrix = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read_dimension(self):
+        if not os.path.exists(self._path("meta.json")):
+            return None
+        with open(self._path("meta.json"), "r") as f:
+            return json.load(f)["dimension"]
+
+    def _write_dimension(self, dimension):
+        # Written to a temporary file and renamed, so other workers never read a half-written meta.json
+        temp_path = self._path(f"meta.json.{os.getpid()}")
+        with open(temp_path, "w") as f:
+            json.dump({"dimension": dimension}, f)
+        os.replace(temp_path, self._path("meta.json"))
+
+    def _load_disk_index(self):
+        self._dimension = self._read_dimension()
+        if self._dimension is None or not os.path.exists(self._path("keys.txt")):
+            return
+        # Only trust rows that were fully written to the vector file
+        complete_rows = os.path.getsize(self._path("vectors.f32")) // (4 * self._dimension)
+        with open(self._path("keys.txt"), "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and int(parts[1]) < complete_rows:
+                    self._rows[parts[0]] = int(parts[1])
+
+    def _disk_vector(self, row):
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            rows = os.path.getsize(self._path("vectors.f32")) // (4 * self._dimension)
+            self._matrix = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r",
+                                     shape=(rows, self._dimension))
+        return np.array(self._matrix[row])
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get(self, content, engine):
+        keys = [content_key(content, engine)]
+        found = self._lookup_memory(keys)
+        on_disk = [key for key in keys if key not in found and key in self._rows]
+        return self._count(keys, found, self._read_disk(on_disk))[0]
+
+    async def aget(self, content, engine):
+        return (await self.aget_many([content], engine))[0]
+
+    async def aget_many(self, contents, engine):
+        """Cached vector (or None) for each content; vectors only on disk are read off the event loop."""
+        keys = [content_key(content, engine) for content in contents]
+        found = self._lookup_memory(keys)
+        on_disk = [key for key in keys if key not in found and key in self._rows]
+        read = await run_blocking(self._read_disk, on_disk) if on_disk else {}
+        return self._count(keys, found, read)
+
+    def _lookup_memory(self, keys):
+        found = {}
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                found[key] = vector
+        return found
+
+    def _read_disk(self, keys):
+        return {key: self._disk_vector(self._rows[key]) for key in keys}
+
+    def _count(self, keys, in_memory, read):
+        vectors = []
+        for key in keys:
+            vector = in_memory.get(key)
+            if vector is None and key in read:
+                vector = in_memory[key] = read.pop(key)
+                self._remember(key, vector)
+                self.disk_hits += 1
+            if vector is None:
+                self.misses += 1
+                vectors.append(None)
+                continue
+            self.hits += 1
+            vectors.append(vector.tolist())
+        return vectors
+
+    def put(self, content, engine, vector):
+        self._append(self._stage([(content, vector)], engine))
+
+    async def aput(self, content, engine, vector):
+        await self.aput_many([(content, vector)], engine)
+
+    async def aput_many(self, items, engine):
+        """Cache (content, vector) pairs; the disk append runs off the event loop, one locked write per call."""
+        pending = self._stage(items, engine)
+        if pending:
+            await run_blocking(self._append, pending)
+
+    def _stage(self, items, engine):
+        """Remember the vectors in memory and return the (key, vector) pairs still to append to disk."""
+        pending = {}
+        for content, vector in items:
+            key = content_key(content, engine)
+            vector = np.asarray(vector, dtype=np.float32)
+            self._remember(key, vector)
+            if self.cache_dir and key not in self._rows:
+                pending[key] = vector
+        return list(pending.items())
+
+    def _append(self, pending):
+        if not pending:
+            return
+        if self._dimension is not None:
+            pending = [(key, vector) for key, vector in pending if len(vector) == self._dimension]
+            if not pending:
+                return
+        with open(self._path("vectors.f32"), "ab") as f:
+            # Held until both files are written, so no other process can claim the same rows
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if self._dimension is None:
+                # Another worker may have fixed the dimension since this cache was opened
+                self._dimension = self._read_dimension()
+                if self._dimension is None:
+                    self._dimension = len(pending[0][1])
+                    self._write_dimension(self._dimension)
+                pending = [(key, vector) for key, vector in pending if len(vector) == self._dimension]
+                if not pending:
+                    return
+            # The append position was taken when the file was opened, before the lock
+            first_row = f.seek(0, os.SEEK_END) // (4 * self._dimension)
+            f.truncate(first_row * 4 * self._dimension)  # drop a partially written row left by a crash
+            f.write(b"".join(vector.tobytes() for _, vector in pending))
+            f.flush()
+            with open(self._path("keys.txt"), "a") as keys:
+                keys.write("".join(f"{key} {row}\n" for row, (key, _) in enumerate(pending, start=first_row)))
+        for row, (key, _) in enumerate(pending, start=first_row):
+            self._rows[key] = row
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._rows),
+        }
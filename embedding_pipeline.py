@@ -0,0 +1,98 @@
+# --------------------
+# Batched embedding pipeline
+# --------------------
+# Embeds many segment texts per request and upserts the resulting vectors in
+# chunks, instead of one embedding call and one upsert per segment. The
+# embedding and upsert backends are plain async callables so the pipeline can
+# run against local fakes as well as OpenAI and Pinecone.
+import asyncio
+
+from retry_policy import classify_error, FATAL
+
+EMBED_BATCH_SIZE = 64
+UPSERT_BATCH_SIZE = 100
+MAX_BATCH_RETRIES = 3
+MAX_CONCURRENT_BATCHES = 4
+RETRY_DELAY = 1
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def _with_retries(fn, max_retries, retry_delay, what):
+    for attempt in range(max_retries):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt < max_retries - 1:
+                print(f"Error occurred while {what}. Retry attempt {attempt + 1}: {e}")
+                await asyncio.sleep(retry_delay * 2 ** attempt)
+            else:
+                raise
+
+
+async def embed_texts(items, embed_batch, batch_size=EMBED_BATCH_SIZE, max_retries=MAX_BATCH_RETRIES,
+                      retry_delay=RETRY_DELAY, max_concurrency=MAX_CONCURRENT_BATCHES):
+    """Embed (unique_id, text) items. Returns ({unique_id: vector}, [unique_ids that failed])."""
+    vectors = {}
+    failed = []
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def embed(texts):
+        async with semaphore:
+            return await embed_batch(texts)
+
+    async def run(batch):
+        try:
+            embeddings = await _with_retries(lambda: embed([text for _, text in batch]),
+                                             max_retries, retry_delay, f"embedding {len(batch)} segments")
+        except Exception as e:
+            # Only a rejected request (e.g. one bad input) is worth splitting; rate limits and outages
+            # would fail every half too, so the batch fails once and the caller retries it later
+            if len(batch) == 1 or classify_error(e) != FATAL:
+                print(f"Failed to embed {len(batch)} segments: {e}")
+                failed.extend(unique_id for unique_id, _ in batch)
+                return
+            middle = len(batch) // 2
+            await run(batch[:middle])
+            await run(batch[middle:])
+            return
+        for (unique_id, _), vector in zip(batch, embeddings):
+            vectors[unique_id] = vector
+
+    await asyncio.gather(*(run(batch) for batch in chunked(list(items), batch_size)))
+    return vectors, failed
+
+
+async def upsert_vectors(vectors, upsert, namespace, batch_size=UPSERT_BATCH_SIZE, max_retries=MAX_BATCH_RETRIES,
+                         retry_delay=RETRY_DELAY, max_concurrency=MAX_CONCURRENT_BATCHES):
+    """Upsert {unique_id: vector} in chunks. Returns the unique_ids whose chunk could not be written."""
+    failed = []
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def write(batch):
+        async with semaphore:
+            await upsert(batch, namespace)
+
+    async def run(batch):
+        try:
+            await _with_retries(lambda: write(batch), max_retries, retry_delay,
+                                f"upserting {len(batch)} vectors")
+        except Exception as e:
+            print(f"Failed to upsert {len(batch)} vectors: {e}")
+            failed.extend(unique_id for unique_id, _ in batch)
+
+    await asyncio.gather(*(run(batch) for batch in chunked(list(vectors.items()), batch_size)))
+    return failed
+
+
+async def embed_and_upsert(items, embed_batch, upsert, namespace="convo-logs", embed_batch_size=EMBED_BATCH_SIZE,
+                           upsert_batch_size=UPSERT_BATCH_SIZE, max_retries=MAX_BATCH_RETRIES,
+                           retry_delay=RETRY_DELAY, max_concurrency=MAX_CONCURRENT_BATCHES):
+    """Embed and upsert (unique_id, text) items. Returns the unique_ids that did not make it into the index."""
+    vectors, failed = await embed_texts(items, embed_batch, embed_batch_size, max_retries, retry_delay,
+                                        max_concurrency)
+    failed += await upsert_vectors(vectors, upsert, namespace, upsert_batch_size, max_retries, retry_delay,
+                                   max_concurrency)
+    return failed
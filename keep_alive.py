@@ -1,15 +1,21 @@
-from flask import Flask
+from flask import Flask, Response
 from threading import Thread
 
+from metrics import registry
+
 app = Flask('')
 
 @app.route('/')
 def home():
   return "I'm Alive"
 
-def run():
-  app.run(host='0.0.0.0', port=8080)
+@app.route('/metrics')
+def metrics():
+  return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def run(port=8080):
+  app.run(host='0.0.0.0', port=port)
 
-def keep_alive():
-  t = Thread(target=run)
-  t.start()
\ No newline at end of file
+def keep_alive(port=8080):
+  t = Thread(target=run, args=(port,))
+  t.start()
@@ -0,0 +1,83 @@
+# --------------------
+# Multi-process launcher
+# --------------------
+# Runs the bot as several worker processes on one host, each owning a slice of
+# the Discord shards: python launcher.py
+#   SHARD_COUNT  total shards (default: 2 per worker)
+#   WORKERS      worker processes (default: CPU count)
+# Workers share flags, open conversations, sessions and the request queue
+# through SHARED_STATE=sqlite (see shared_state.py), so saved conversations
+# must use CHAT_STORE=sqlite and vectors a shared index (not VECTOR_STORE=local).
+# Each worker serves its keep-alive page and /metrics on KEEP_ALIVE_PORT + its
+# worker number.
+# A worker that exits is restarted after a short delay.
+import os
+import sys
+import time
+import signal
+import subprocess
+
+from shared_state import check_worker_backends
+
+RESTART_DELAY = 5
+
+
+def shard_slices(shard_count, workers):
+    """Spread shard ids round-robin over the workers."""
+    return [list(range(worker, shard_count, workers)) for worker in range(workers)]
+
+
+def worker_env(worker, shard_ids, shard_count):
+    env = dict(os.environ)
+    env.update({
+        'WORKER_ID': str(worker),
+        'SHARD_COUNT': str(shard_count),
+        'SHARD_IDS': ','.join(str(shard_id) for shard_id in shard_ids),
+        'SHARED_STATE': env.get('SHARED_STATE', 'sqlite'),
+        'KEEP_ALIVE_PORT': str(int(env.get('KEEP_ALIVE_PORT', 8080)) + worker),
+    })
+    return env
+
+
+def spawn(worker, shard_ids, shard_count, script='main.py'):
+    print(f"Starting worker {worker} with shards {shard_ids}")
+    return subprocess.Popen([sys.executable, script], env=worker_env(worker, shard_ids, shard_count))
+
+
+def main():
+    try:
+        check_worker_backends(os.environ.get('SHARED_STATE', 'sqlite'), os.environ.get('CHAT_STORE', 'json'),
+                              os.environ.get('VECTOR_STORE', 'pinecone'))
+    except ValueError as e:
+        sys.exit(str(e))  # every worker would fail the same way, and be restarted forever
+    workers = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+    shard_count = int(os.environ.get('SHARD_COUNT', workers * 2))
+    workers = min(workers, shard_count)
+    slices = shard_slices(shard_count, workers)
+    processes = {worker: spawn(worker, slices[worker], shard_count) for worker in range(workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        time.sleep(1)
+        for worker, process in list(processes.items()):
+            if process.poll() is not None and not stopping:
+                print(f"Worker {worker} exited with code {process.returncode}, restarting in {RESTART_DELAY}s")
+                time.sleep(RESTART_DELAY)
+                processes[worker] = spawn(worker, slices[worker], shard_count)
+
+    for process in processes.values():
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# --------------------
+# Event loop lag monitor
+# --------------------
+# A background task that repeatedly sleeps for a short interval and records how
+# late it wakes up. Anything that blocks the loop thread (a synchronous HTTP
+# call, file I/O, heavy CPU work) shows up directly as lag, and long lag is what
+# stalls Discord heartbeats.
+import time
+import asyncio
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.1, window=3000, report_every=300, warn_threshold=0.25):
+        self.interval = interval
+        self.report_every = report_every
+        self.warn_threshold = warn_threshold
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task = None
+        # stats() is also called from the /metrics thread while the loop appends samples
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        last_report = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            with self._lock:
+                self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.warn_threshold:
+                print(f"Event loop blocked for {lag * 1000:.0f} ms")
+            if self.report_every and time.monotonic() - last_report >= self.report_every:
+                last_report = time.monotonic()
+                stats = self.stats()
+                print(f"Event loop lag p50 {stats['p50'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms, "
+                      f"max {stats['max'] * 1000:.1f} ms")
+
+    def stats(self):
+        with self._lock:
+            samples = np.fromiter(self.samples, dtype=float, count=len(self.samples))
+        if not len(samples):
+            return {"p50": 0.0, "p99": 0.0, "max": self.max_lag, "samples": 0}
+        return {
+            "p50": float(np.percentile(samples, 50)),
+            "p99": float(np.percentile(samples, 99)),
+            "max": self.max_lag,
+            "samples": len(samples),
+        }
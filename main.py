@@ -24,19 +24,31 @@ import openai
 import json
 import re
 import asyncio
+import signal
 from discord.ext import commands
 from keep_alive import keep_alive
 from discord.errors import NotFound
-import numpy as np
-import time
-import uuid as uuid_lib
-import datetime
 import pinecone
+from embedding_cache import EmbeddingCache
+from vector_store import get_vector_store
+from chat_store import get_chat_store
+from loop_monitor import LoopLagMonitor
+import async_clients
+from conversation_timer import InactivityTimer
+from shared_state import get_shared_store, check_worker_backends
+from metrics import registry
+from pipeline import ChatPipeline
 
 # --------------------
 # Global variables
 # --------------------
-bot_sleeping = False
+# Flags, open conversations, sessions and the request queue live in a shared
+# store so every worker process sees the same state (SHARED_STATE=sqlite)
+SHARED_STATE = os.environ.get('SHARED_STATE', 'local')
+WORKER_ID = os.environ.get('WORKER_ID', '0')
+shared_store = get_shared_store(SHARED_STATE)
+# Conversation timers don't survive a restart, so drop whatever this worker held before
+shared_store.release_conversations(WORKER_ID)
 
 # --------------------
 # Utility functions
@@ -45,9 +57,11 @@ def load_prompt_parameters(filename):
     with open(filename, 'r') as file:
         return json.load(file)
 
-def should_respond():
-    global bot_sleeping
-    return not bot_sleeping
+async def is_sleeping():
+    return await shared_store.aget_flag('bot_sleeping')
+
+async def should_respond():
+    return not await is_sleeping()
 
 # --------------------
 # Environment variables and API keys
@@ -59,233 +73,81 @@ PINECONE_KEY = os.environ.get('YOUR_PINECONE_API_KEY')
 openai.api_key = OPENAI_KEY
 
 intents = discord.Intents.all()
-client = commands.Bot(command_prefix="!", intents=intents)
-
-active_threads = set()
-
-user_chat_histories = {}
-
-MAX_RETRIES = 10
-
-pinecone.init(api_key=PINECONE_KEY, environment='us-east1-gcp')
-indexer = pinecone.Index("brain69")
-
-# --------------------
-# GPT-3 Embedding function
-# --------------------
-async def gpt3_embedding(content, engine='text-embedding-ada-002'):
-    content = content.encode(encoding='ASCII', errors='ignore').decode()  # fix any UNICODE errors
-    loop = asyncio.get_event_loop()
-    response = await loop.run_in_executor(None, lambda: openai.Embedding.create(
-        input=content,
-        engine=engine
-    ))
-    vector = response['data'][0]['embedding']  # this is a normal list
-    return vector
-
-# --------------------
-# Save chat history function
-# --------------------
-async def save_chat_history(user_id, chat_history, chat_logs_folder="chat_logs"):
-    try:
-        user_folder = os.path.join(chat_logs_folder, str(user_id))
-        os.makedirs(user_folder, exist_ok=True)
-
-        timestamp = int(time.time())
-        formatted_timestamp = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-        for i in range(0, len(chat_history), 3):
-            segment = chat_history[i:i+3]
-            unique_id = str(uuid_lib.uuid4())
-
-            metadata = {
-                "timestamp": formatted_timestamp,
-                "unique_id": unique_id,
-                "user_id": user_id,
-            }
-
-            segmented_chat_log = {
-                "metadata": metadata,
-                "chat_history": segment,
-            }
-
-            # Save chat log to a file
-            with open(os.path.join(user_folder, f"{unique_id}.json"), "w") as file:
-                json.dump(segmented_chat_log, file, indent=4)
-
-            # Vectorize the chat log and upsert it to the Pinecone index
-            content = ' '.join([message['content'] for message in segment])
-            vector = await gpt3_embedding(content)
-            vector_np = np.array(vector)  # Convert the list to a NumPy array
-            
-            indexer.upsert([(unique_id, vector_np.tolist())], namespace="convo-logs")  # Updated line
-    except Exception as e:
-        print(f"Failed to save chat history: {e}")
-
-# --------------------
-# Query Pinecone function
-# --------------------
-async def query_pinecone(query, top_k=3, namespace="convo-logs"):
-    query_vector = await gpt3_embedding(query)
-    query_vector_np = np.array(query_vector)
-    query_results = indexer.query(
-        vector=query_vector_np.tolist(),
-        top_k=top_k,
-        namespace=namespace,
-    )
-    return [(match['id'], match['score']) for match in query_results['matches']]
-
-# --------------------
-# Load chat history function
-# --------------------
-def load_chat_history(user_id, chat_logs_folder="chat_logs"):
-    user_folder = os.path.join(chat_logs_folder, str(user_id))
-
-    # Check if the user folder exists
-    if not os.path.exists(user_folder):
-        return []
-
-    user_chat_histories[user_id] = []
-
-    chat_files = []
-    for root, _, files in os.walk(user_folder):
-        for file in files:
-            if file.endswith(".json"):
-                chat_files.append(os.path.join(root, file))
-
-    # Sort files based on timestamp
-    chat_files.sort(key=lambda x: json.load(open(x))["metadata"]["timestamp"])
-
-    for chat_file in chat_files:
-        try:
-            with open(chat_file, "r") as file:
-                segmented_chat_log = json.load(file)
-                if segmented_chat_log["metadata"]["user_id"] == user_id:
-                    user_chat_histories[user_id].extend(segmented_chat_log["chat_history"])
-        except FileNotFoundError:
-            print(f"Chat history file not found for user {user_id} with file {chat_file}.")
-
-# --------------------
-# Load recent messages function
-# --------------------
-def load_recent_messages(user_id, num_messages=10, chat_logs_folder="chat_logs"):
-    user_folder = os.path.join(chat_logs_folder, str(user_id))
-
-    if not os.path.exists(user_folder):
-        return []
-
-    chat_files = []
-    for root, _, files in os.walk(user_folder):
-        for file in files:
-            if file.endswith(".json"):
-                chat_files.append(os.path.join(root, file))
-
-    chat_files.sort(key=lambda x: json.load(open(x))["metadata"]["timestamp"], reverse=True)
-
-    recent_messages = []
-    for chat_file in chat_files:
-        try:
-            with open(chat_file, "r") as file:
-                segmented_chat_log = json.load(file)
-                if segmented_chat_log["metadata"]["user_id"] == user_id:
-                    recent_messages.extend(segmented_chat_log["chat_history"])
-                if len(recent_messages) >= num_messages:
-                    break
-        except FileNotFoundError:
-            print(f"Chat history file not found for user {user_id} with file {chat_file}.")
-
-    return recent_messages[-num_messages:]
-
-# --------------------
-# Add chat history function
-# --------------------
-def add_chat_history(user_id, author, content):
-    global user_chat_histories
-    if content.lower() == "!end":
-        return
-
-    if user_id not in user_chat_histories:
-        user_chat_histories[user_id] = []
-    user_chat_histories[user_id].append({"role": "user" if author != client.user else "assistant", "content": content})
-    user_chat_histories[user_id] = user_chat_histories[user_id][-6:]
+# SHARD_COUNT/SHARD_IDS run the given shards in this process (launcher.py spreads
+# them across workers); AUTO_SHARD=1 lets Discord pick the shard count
+SHARD_COUNT = os.environ.get('SHARD_COUNT')
+SHARD_IDS = os.environ.get('SHARD_IDS')
+if SHARD_COUNT:
+    client = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=int(SHARD_COUNT),
+                                     shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(',')] if SHARD_IDS else None)
+elif os.environ.get('AUTO_SHARD', '0') == '1':
+    client = commands.AutoShardedBot(command_prefix="!", intents=intents)
+else:
+    client = commands.Bot(command_prefix="!", intents=intents)
+
+MAX_RETRIES = 5
+
+CONVERSATION_TIMEOUT = 15 * 60
+
+SESSION_HISTORY_LENGTH = 6
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 60 * 60))
+SESSION_MEMORY_LIMIT = int(os.environ.get('SESSION_MEMORY_LIMIT', 64 * 1024 * 1024))
+
+MAX_CONCURRENT_REQUESTS = 30
+# Streaming edits need the reply to be generated in the process holding the channel
+STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', '0') == '1' and SHARED_STATE == 'local'
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3500))
+REQUEST_QUEUE_SIZE = int(os.environ.get('REQUEST_QUEUE_SIZE', 200))
+
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 64))
+UPSERT_BATCH_SIZE = int(os.environ.get('UPSERT_BATCH_SIZE', 100))
+
+VECTOR_STORE = os.environ.get('VECTOR_STORE', 'pinecone')
+check_worker_backends(SHARED_STATE, os.environ.get('CHAT_STORE', 'json'), VECTOR_STORE)
+
+indexer = None
+async_indexer = None
+if VECTOR_STORE == 'pinecone':
+    pinecone.init(api_key=PINECONE_KEY, environment='us-east1-gcp')
+    indexer = pinecone.Index("brain69")
+    async_indexer = async_clients.AsyncPineconeIndex(
+        f"https://brain69-{pinecone.Config.PROJECT_NAME}.svc.us-east1-gcp.pinecone.io", PINECONE_KEY)
+vector_store = get_vector_store(VECTOR_STORE, indexer, async_indexer)
+
+chat_store = get_chat_store()
+
+embedding_cache = EmbeddingCache(capacity=int(os.environ.get('EMBEDDING_CACHE_SIZE', 10000)),
+                                 cache_dir=os.environ.get('EMBEDDING_CACHE_DIR'))
+
+loop_lag_monitor = LoopLagMonitor()
 
 prompt_parameters = load_prompt_parameters('prompt_parameters.json')
 
-api_semaphore = asyncio.Semaphore(30)
-
 # --------------------
-# Request queue and processing
+# Message pipeline
 # --------------------
-request_queue = asyncio.Queue()
-
-async def process_requests():
-    while True:
-        tasks = []
-        for _ in range(api_semaphore._value):  # Get the available API slots
-            if not request_queue.empty():
-                user_id, message_content, response_future = await request_queue.get()
-                task = asyncio.create_task(get_response(user_id, message_content))
-                tasks.append((task, response_future))
-                request_queue.task_done()
-            else:
-                break
-
-        if tasks:
-            # Use asyncio.gather() to process tasks concurrently
-            results = await asyncio.gather(*(task for task, _ in tasks), return_exceptions=True)
-
-            # Set the result or exception in the respective response_future
-            for (task, response_future), result in zip(tasks, results):
-                if isinstance(result, Exception):
-                    response_future.set_exception(result)
-                else:
-                    response_future.set_result(result)
-
-        try:
-            await asyncio.wait_for(request_queue.join(), timeout=0.5)  # Short sleep to avoid excessive looping
-        except asyncio.exceptions.TimeoutError:
-            pass  # Ignore the timeout and continue the loop
-
-async def get_response(message_author_id, message_content):
-    for attempt in range(MAX_RETRIES):
-        try:
-            # Query Pinecone for the 10 most semantically relevant messages by UUID
-            pinecone_results = await query_pinecone(message_content)
-            relevant_messages = []
-            for uuid_val, _ in pinecone_results:
-                # search for the file in all folders under chat_logs
-                for user_folder in os.listdir('chat_logs'):
-                    folder_path = os.path.join('chat_logs', user_folder)
-                    if not os.path.isdir(folder_path):
-                        continue
-                    file_path = os.path.join(folder_path, f"{uuid_val}.json")
-                    if not os.path.exists(file_path):
-                        continue
-                    with open(file_path, "r") as f:
-                        chat_log = json.load(f)
-                        relevant_messages.extend(chat_log["chat_history"])
-
-            # Combine the semantically relevant messages with the recent messages
-            recent_messages = user_chat_histories.get(message_author_id, [])
-            combined_messages = relevant_messages + recent_messages
-
-            async with api_semaphore:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(None, lambda: openai.ChatCompletion.create(
-                    model=prompt_parameters["model"],
-                    messages=prompt_parameters["messages"] + combined_messages + [{"role": "user", "content": message_content}],
-                    max_tokens=400,
-                    temperature=0.4,
-                    frequency_penalty=0.25,
-                    presence_penalty=0.05
-                ))
-            return response.choices[0].message['content'].strip()
-        except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                print(f"Error occurred while processing message. Retry attempt {attempt + 1}: {e}")
-                await asyncio.sleep(1)
-            else:
-                raise e
+pipeline = ChatPipeline(chat_store, vector_store, embedding_cache, prompt_parameters,
+                        shared_store=shared_store if SHARED_STATE != 'local' else None, worker_id=WORKER_ID,
+                        session_history_length=SESSION_HISTORY_LENGTH, session_ttl=SESSION_TTL,
+                        session_memory_limit=SESSION_MEMORY_LIMIT, max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                        request_queue_size=REQUEST_QUEUE_SIZE, context_token_budget=CONTEXT_TOKEN_BUDGET,
+                        embed_batch_size=EMBED_BATCH_SIZE, upsert_batch_size=UPSERT_BATCH_SIZE,
+                        max_retries=MAX_RETRIES, stream_responses=STREAM_RESPONSES,
+                        # One log per worker process, each resumes its own unfinished saves
+                        write_behind_path=os.environ.get('WRITE_BEHIND_PATH',
+                                                         os.path.join('chat_logs', f'write_behind-{WORKER_ID}.wal')))
+sessions = pipeline.sessions
+load_chat_history = pipeline.load_chat_history
+load_recent_messages = pipeline.load_recent_messages
+
+# Served at /metrics on the keep-alive server
+pipeline.register_metrics(registry)
+def loop_lag_quantiles():
+    stats = loop_lag_monitor.stats()
+    return {('0.5',): stats['p50'], ('0.99',): stats['p99']}
+
+registry.callback('bot_event_loop_lag_seconds', 'Event loop lag over the recent window, by quantile.',
+                  loop_lag_quantiles, labelnames=('quantile',))
 
 # --------------------
 # Client events and commands
@@ -293,50 +155,55 @@ async def get_response(message_author_id, message_content):
 @client.event
 async def on_ready():
     print('We have logged in as {0.user} in main'.format(client))
-    asyncio.create_task(process_requests())
+    pipeline.start()
+    loop_lag_monitor.start()
+    conversation_timer.start()
 
 @client.command()
 async def chat(ctx):
-    if ctx.author.id in active_threads:
+    # Claiming is atomic across worker processes, so a user can't open two threads at once
+    if not await shared_store.aclaim_conversation(ctx.author.id, WORKER_ID):
         await ctx.send("Woooah easy tiger! One conversation not enough for you?")
     else:
         print("Chat command triggered")
-
-        # Load chat history for the user only if it's not already loaded
-        if ctx.author.id not in user_chat_histories:
-            load_chat_history(ctx.author.id)
-
-        # Check if the ctx.channel is a TextChannel before creating a thread
-        if not isinstance(ctx.channel, discord.TextChannel):
-            await ctx.send("You can only start a chat in a text channel.")
-            return
-
-        thread = await ctx.channel.create_thread(name=f"Chat with {ctx.author.name}", type=discord.ChannelType.private_thread)
-        await thread.send(f"Hello {ctx.author.mention}! You can start chatting with me. Type '!end' to end the conversation.")
-        active_threads.add(ctx.author.id)
-
-        # Call end_inactive_conversation after starting the conversation
-        asyncio.create_task(end_inactive_conversation(ctx.author.id, thread))
+        try:
+            # Load chat history for the user only if it's not already loaded
+            if not await sessions.amessages(ctx.author.id):
+                await load_chat_history(ctx.author.id)
+
+            # Check if the ctx.channel is a TextChannel before creating a thread
+            if not isinstance(ctx.channel, discord.TextChannel):
+                await shared_store.arelease_conversation(ctx.author.id)
+                await ctx.send("You can only start a chat in a text channel.")
+                return
+
+            thread = await ctx.channel.create_thread(name=f"Chat with {ctx.author.name}", type=discord.ChannelType.private_thread)
+            await thread.send(f"Hello {ctx.author.mention}! You can start chatting with me. Type '!end' to end the conversation.")
+        except BaseException:
+            # No thread to chat in, so don't leave the user locked out of starting another
+            await shared_store.arelease_conversation(ctx.author.id)
+            raise
+
+        # The conversation ends after CONVERSATION_TIMEOUT seconds without activity
+        conversation_timer.add(ctx.author.id, thread)
 
 @client.command()
 async def end(ctx):
     if isinstance(ctx.channel, discord.Thread) and ctx.channel.is_private:
         user_id = ctx.author.id
-        if user_id in user_chat_histories:
-            chat_history = user_chat_histories[user_id]
-            asyncio.create_task(save_chat_history(user_id, chat_history))
-            del user_chat_histories[user_id]
+        conversation_timer.cancel(user_id)
+        # Logged durably here; saving and indexing continue in the background
+        await pipeline.end_conversation(user_id)
 
         await asyncio.sleep(2)
         await ctx.channel.delete()
-        active_threads.discard(ctx.author.id)
+        await shared_store.arelease_conversation(ctx.author.id)
 
 @client.command()
 @commands.has_permissions(administrator=True)
 async def sleep(ctx):
-    global bot_sleeping
-    if not bot_sleeping:
-        bot_sleeping = True
+    if not await is_sleeping():
+        await shared_store.aset_flag('bot_sleeping', True)
         await ctx.send("Man I'm zonked! I'm going to get some shut eye boss man... zzzzz")
     else:
         await ctx.send("I'm already sleeping... zzzzz")
@@ -344,22 +211,17 @@ async def sleep(ctx):
 @client.command()
 @commands.has_permissions(administrator=True)
 async def wake(ctx):
-    global bot_sleeping
-    if bot_sleeping:
-        bot_sleeping = False
+    if await is_sleeping():
+        await shared_store.aset_flag('bot_sleeping', False)
         await ctx.send("Good morning! I'm awake and ready to chat.")
     else:
         await ctx.send("I'm already awake!")
 
-async def end_inactive_conversation(user_id, channel, timeout=15*60):
-    await asyncio.sleep(timeout)
-    if user_id not in active_threads:
+async def end_inactive_conversation(user_id, channel):
+    if not await shared_store.ais_conversation_active(user_id):
         return
 
-    if user_id in user_chat_histories:
-        chat_history = user_chat_histories[user_id]
-        await save_chat_history(user_id, chat_history)
-        del user_chat_histories[user_id]
+    await pipeline.end_conversation(user_id)
 
     try:
         await channel.delete()
@@ -368,7 +230,14 @@ async def end_inactive_conversation(user_id, channel, timeout=15*60):
     except Exception as e:
         print(f"Error occurred while deleting the channel for user {user_id}: {e}")
 
-    active_threads.discard(user_id)
+    await shared_store.arelease_conversation(user_id)
+
+async def end_inactive_conversations(expired):
+    await asyncio.gather(*(end_inactive_conversation(user_id, channel) for user_id, channel in expired))
+    # Sweep sessions that went idle without ever being touched again
+    sessions.evict()
+
+conversation_timer = InactivityTimer(end_inactive_conversations, timeout=CONVERSATION_TIMEOUT)
 
 def clean_input(text):
     # Remove non-ASCII characters
@@ -380,8 +249,7 @@ async def on_message(message):
     if message.author == client.user:
         return
 
-    global bot_sleeping  # Add this line to access the bot_sleeping variable
-    if bot_sleeping and not message.content.lower() in ["!wake", "!end"]:
+    if await is_sleeping() and not message.content.lower() in ["!wake", "!end"]:
         if message.content.lower() == "!chat":
             await message.channel.send("Sorry, I'm sleeping right now... zzzzz")
         return
@@ -393,38 +261,40 @@ async def on_message(message):
     if not isinstance(message.channel, discord.Thread) or not message.channel.is_private:
         return
 
+    # Any message in the conversation's thread keeps it alive
+    conversation_timer.refresh(message.author.id)
+
     # Load the most recent messages when the !chat command is used
     if message.content.startswith("!chat"):
-        recent_messages = load_recent_messages(message.author.id)
-        user_chat_histories[message.author.id] = recent_messages
+        recent_messages = await load_recent_messages(message.author.id)
+        await sessions.aset_history(message.author.id, recent_messages)
 
     cleaned_message_content = clean_input(message.content)
     if cleaned_message_content.strip() in ["!end", "!chat"]:
         return
 
-    add_chat_history(message.author.id, message.author, cleaned_message_content)
-
-    response_future = asyncio.Future()
+    await pipeline.handle_message(message.channel, message.author.id, cleaned_message_content,
+                                  ignored_errors=(NotFound,))
 
-    await request_queue.put((message.author.id, cleaned_message_content, response_future))
 
+async def run_bot():
+    # SIGTERM (e.g. from launcher.py) closes the client like Ctrl+C does, so the shutdown below still runs
     try:
-        # Add the following line to show the bot is typing while waiting for the response
-        async with message.channel.typing():
-            response_text = await response_future
-
-        # Check if the channel still exists before sending a message
-        if message.channel:
-            await message.channel.send(response_text)
-            # Add the bot's response to the user's chat history
-            add_chat_history(message.author.id, client.user, response_text)
-
-    except NotFound:
-        pass
-    except Exception as e:
-        print(f"Error occurred while processing message after all retries: {e}")
-        await message.channel.send("I'm sorry, there was an issue processing your request. Please try again later.")
-
-
-keep_alive()
-client.run(TOKEN)
\ No newline at end of file
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(client.close()))
+    except NotImplementedError:
+        pass  # no signal handlers on Windows event loops
+    async with client:
+        try:
+            await client.start(TOKEN)
+        finally:
+            # Finish saving ended conversations; whatever doesn't make it resumes from the log on the next start
+            await pipeline.stop()
+            await async_clients.close()
+
+# Each worker on a host needs its own keep-alive port (launcher.py hands them out)
+if os.environ.get('KEEP_ALIVE', '1') == '1':
+    keep_alive(int(os.environ.get('KEEP_ALIVE_PORT', 8080)))
+try:
+    asyncio.run(run_bot())
+except KeyboardInterrupt:
+    pass
\ No newline at end of file
@@ -0,0 +1,318 @@
+# --------------------
+# Message pipeline
+# --------------------
+# Everything between a user's message arriving and the reply being sent that
+# does not need Discord itself: sessions, retrieval, the completion call with
+# retries, the request scheduler and saving/indexing finished conversations
+# (through the write-behind queue in write_behind.py).
+# main.py builds one ChatPipeline from its settings and wires it to the
+# Discord client; the backends (chat store, vector store, embedding and
+# completion calls) are passed in so the same code runs against fakes in
+# benchmarks/replay.py.
+import os
+import time
+import uuid
+import asyncio
+
+import async_clients
+from async_clients import run_blocking
+from chat_store import split_segments
+from context_builder import build_context, count_tokens
+from embedding_pipeline import embed_and_upsert
+from metrics import registry
+from request_scheduler import FairScheduler, SharedQueueScheduler
+from retry_policy import RetryPolicy, CircuitBreaker
+from session_manager import SessionManager
+from streaming import StreamingReply, stream_completion_text
+from write_behind import WriteBehindQueue
+
+# Served at /metrics on the keep-alive server; see ChatPipeline.register_metrics for the rest
+stage_seconds = registry.histogram('bot_stage_seconds', 'Time spent in each stage of handling a message.',
+                                   labelnames=('stage',))
+request_seconds = registry.histogram('bot_request_seconds', 'Time from receiving a message to sending the reply.')
+tokens_total = registry.counter('bot_tokens_total', 'Prompt and completion tokens sent to and received from OpenAI.',
+                                labelnames=('kind',))
+
+
+class ReplyInterruptedError(Exception):
+    """A streamed reply failed after part of it was shown; retrying would repeat it."""
+
+
+class ChatPipeline:
+    def __init__(self, chat_store, vector_store, embedding_cache, prompt_parameters,
+                 embedding_create=async_clients.embedding_create,
+                 chat_completion_create=async_clients.chat_completion_create,
+                 shared_store=None, worker_id='0', session_history_length=6, session_ttl=60 * 60,
+                 session_memory_limit=64 * 1024 * 1024, max_concurrent_requests=30, request_queue_size=200,
+                 context_token_budget=3500, embed_batch_size=64, upsert_batch_size=100, max_retries=5,
+                 stream_responses=False, write_behind_path=os.path.join("chat_logs", "write_behind.wal")):
+        self.chat_store = chat_store
+        self.vector_store = vector_store
+        self.embedding_cache = embedding_cache
+        self.prompt_parameters = prompt_parameters
+        self.embedding_create = embedding_create
+        self.chat_completion_create = chat_completion_create
+        self.session_history_length = session_history_length
+        self.context_token_budget = context_token_budget
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.stream_responses = stream_responses
+
+        # Finished conversations are logged durably, then saved and indexed in the background
+        self.write_behind = WriteBehindQueue(write_behind_path, self._save_transcript, self._index_segments)
+
+        # With a shared store, sessions and the request queue are shared with the other worker processes
+        self.sessions = SessionManager(max_history=session_history_length, ttl=session_ttl,
+                                       memory_limit=session_memory_limit, on_evict=self.flush_evicted_session,
+                                       store=shared_store)
+
+        self.api_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # Shared by every completion call, so an OpenAI outage trips it once for all users
+        self.circuit_breaker = CircuitBreaker(failure_threshold=10, reset_timeout=30)
+        self.retry_policy = RetryPolicy(max_attempts=max_retries, breaker=self.circuit_breaker)
+
+        # A fixed pool of workers serves users round-robin; submit() waits while the queue is full.
+        # With shared state the queue is shared too, and any worker process can pick a request up.
+        if shared_store is None:
+            self.request_scheduler = FairScheduler(self.get_response, workers=max_concurrent_requests,
+                                                   max_queue=request_queue_size)
+        else:
+            self.request_scheduler = SharedQueueScheduler(self.get_response, shared_store, worker_id,
+                                                          workers=max_concurrent_requests,
+                                                          max_queue=request_queue_size)
+        self.request_scheduler.on_start = lambda user_id, queue_wait: stage_seconds.observe(queue_wait,
+                                                                                            stage='queue_wait')
+
+    def start(self):
+        self.request_scheduler.start()
+        self.write_behind.start()
+
+    async def stop(self, drain_timeout=30):
+        """Stop taking requests and finish saving ended conversations; anything unfinished resumes on the next start."""
+        await self.request_scheduler.stop()
+        await self.write_behind.drain(drain_timeout)
+
+    # --------------------
+    # GPT-3 Embedding functions
+    # --------------------
+    async def gpt3_embedding(self, content, engine='text-embedding-ada-002'):
+        content = content.encode(encoding='ASCII', errors='ignore').decode()  # fix any UNICODE errors
+        vector = await self.embedding_cache.aget(content, engine)
+        if vector is not None:
+            return vector
+        with stage_seconds.time(stage='embedding'):
+            response = await self.embedding_create(
+                input=content,
+                engine=engine
+            )
+        vector = response['data'][0]['embedding']  # this is a normal list
+        await self.embedding_cache.aput(content, engine, vector)
+        return vector
+
+    async def gpt3_embedding_batch(self, contents, engine='text-embedding-ada-002'):
+        contents = [content.encode(encoding='ASCII', errors='ignore').decode() for content in contents]
+        vectors = await self.embedding_cache.aget_many(contents, engine)
+        missing = sorted({content for content, vector in zip(contents, vectors) if vector is None})
+        if missing:
+            with stage_seconds.time(stage='embedding_batch'):
+                response = await self.embedding_create(
+                    input=missing,
+                    engine=engine
+                )
+            # The API may return embeddings out of order, each item carries its input index
+            embedded = {missing[item['index']]: item['embedding'] for item in response['data']}
+            await self.embedding_cache.aput_many(embedded.items(), engine)
+            vectors = [vector if vector is not None else embedded[content]
+                       for content, vector in zip(contents, vectors)]
+        return vectors
+
+    # --------------------
+    # Vector upsert and query
+    # --------------------
+    async def vector_upsert(self, vectors, namespace):
+        await self.vector_store.aupsert(vectors, namespace)
+
+    async def query_pinecone(self, query, top_k=3, namespace="convo-logs"):
+        query_vector = await self.gpt3_embedding(query)
+        with stage_seconds.time(stage='vector_query'):
+            return await self.vector_store.aquery(query_vector, top_k, namespace)
+
+    # --------------------
+    # Save chat history
+    # --------------------
+    def _segment_ids(self, chat_history):
+        # Fixed when the job is logged, so a save repeated after a crash overwrites instead of duplicating
+        return [str(uuid.uuid4()) for _ in split_segments(chat_history)]
+
+    async def save_chat_history(self, user_id, chat_history):
+        """Hand a finished conversation to the write-behind queue; returns once it is logged."""
+        await self.write_behind.enqueue(user_id, chat_history, self._segment_ids(chat_history))
+
+    async def end_conversation(self, user_id):
+        """Drop the user's session and queue it to be saved."""
+        chat_history = await self.sessions.apop(user_id)
+        if chat_history:
+            await self.save_chat_history(user_id, chat_history)
+
+    def flush_evicted_session(self, user_id, chat_history):
+        # Evicted sessions go through the normal save path rather than being dropped. Eviction runs
+        # synchronously, so the job is logged from a background task
+        self.write_behind.enqueue_soon(user_id, chat_history, self._segment_ids(chat_history))
+
+    def _save_transcript(self, user_id, chat_history, segment_ids):
+        # Runs in a worker thread from the write-behind queue
+        with stage_seconds.time(stage='save_chat_history'):
+            saved_segments = self.chat_store.save_segments(user_id, split_segments(chat_history), segment_ids)
+        return [(unique_id, ' '.join([message['content'] for message in segment]))
+                for unique_id, segment in saved_segments]
+
+    async def _index_segments(self, items):
+        # Vectorize the chat log segments and upsert them to the vector index in batches
+        with stage_seconds.time(stage='index_chat_history'):
+            return await embed_and_upsert(items, self.gpt3_embedding_batch, self.vector_upsert,
+                                          namespace="convo-logs", embed_batch_size=self.embed_batch_size,
+                                          upsert_batch_size=self.upsert_batch_size)
+
+    # --------------------
+    # Load chat history
+    # --------------------
+    async def load_chat_history(self, user_id):
+        # Only the tail of the history is ever kept in the session, so don't load the rest
+        with stage_seconds.time(stage='chat_log_read'):
+            recent_messages = await run_blocking(self.chat_store.recent_messages, user_id,
+                                                 self.session_history_length)
+        await self.sessions.aset_history(user_id, recent_messages)
+
+    async def load_recent_messages(self, user_id, num_messages=10):
+        with stage_seconds.time(stage='chat_log_read'):
+            return await run_blocking(self.chat_store.recent_messages, user_id, num_messages)
+
+    async def load_segments(self, unique_ids):
+        with stage_seconds.time(stage='chat_log_read'):
+            segments = await run_blocking(self.chat_store.get_segments, unique_ids)
+        return [segments[unique_id] for unique_id in unique_ids if unique_id in segments]
+
+    async def add_chat_history(self, user_id, role, content):
+        if content.lower() == "!end":
+            return
+
+        await self.sessions.aappend(user_id, role, content)
+
+    # --------------------
+    # Responses
+    # --------------------
+    async def retrieve_context(self, message_author_id, message_content):
+        try:
+            # Query Pinecone for the most semantically relevant segments by UUID
+            pinecone_results = await self.query_pinecone(message_content)
+            relevant_segments = await self.load_segments([uuid_val for uuid_val, _ in pinecone_results])
+        except Exception as e:
+            # Recall is a nice-to-have, answer from the recent history alone rather than failing the turn
+            print(f"Failed to retrieve relevant history for user {message_author_id}: {e}")
+            relevant_segments = []
+
+        # Combine the semantically relevant messages with the recent messages within the token budget
+        recent_messages = await self.sessions.amessages(message_author_id)
+        messages, context_stats = build_context(self.prompt_parameters["messages"], relevant_segments,
+                                                recent_messages, {"role": "user", "content": message_content},
+                                                self.context_token_budget)
+        return messages, context_stats["tokens"]
+
+    async def get_response(self, message_author_id, message_content, on_delta=None):
+        # Retrieval runs once; only the completion call is retried
+        with stage_seconds.time(stage='retrieval'):
+            messages, estimated_prompt_tokens = await self.retrieve_context(message_author_id, message_content)
+        completion_kwargs = dict(
+            model=self.prompt_parameters["model"],
+            messages=messages,
+            max_tokens=400,
+            temperature=0.4,
+            frequency_penalty=0.25,
+            presence_penalty=0.05
+        )
+
+        async def attempt():
+            async with self.api_semaphore:
+                with stage_seconds.time(stage='completion'):
+                    if on_delta is None:
+                        response = await self.chat_completion_create(**completion_kwargs)
+                        tokens_total.inc(response['usage']['prompt_tokens'], kind='prompt')
+                        tokens_total.inc(response['usage']['completion_tokens'], kind='completion')
+                        return response['choices'][0]['message']['content'].strip()
+
+                    # Streaming mode: hand each token to on_delta as it arrives
+                    stream = await self.chat_completion_create(stream=True, **completion_kwargs)
+                    chunks = []
+                    try:
+                        async for delta in stream_completion_text(stream):
+                            chunks.append(delta)
+                            await on_delta(delta)
+                    except Exception as e:
+                        if chunks:
+                            raise ReplyInterruptedError(str(e)) from e
+                        raise
+                    # Streamed responses carry no usage block, so use the builder's estimate and count the text
+                    text = ''.join(chunks).strip()
+                    tokens_total.inc(estimated_prompt_tokens, kind='prompt')
+                    tokens_total.inc(count_tokens(text), kind='completion')
+                    return text
+
+        return await self.retry_policy.run(attempt)
+
+    async def handle_message(self, channel, user_id, content, ignored_errors=()):
+        """Answer a user's message in channel. Errors in ignored_errors (e.g. a deleted channel) are dropped."""
+        await self.add_chat_history(user_id, "user", content)
+
+        # In streaming mode the reply is posted early and edited as tokens arrive
+        reply = StreamingReply(channel) if self.stream_responses else None
+        received_at = time.perf_counter()
+        response_future = await self.request_scheduler.submit(user_id, content, reply.feed if reply else None)
+
+        try:
+            # Show the bot is typing while waiting for the response
+            async with channel.typing():
+                response_text = await response_future
+
+            # Check if the channel still exists before sending a message
+            if channel:
+                if reply is not None:
+                    await reply.finish(response_text)
+                else:
+                    await channel.send(response_text)
+                request_seconds.observe(time.perf_counter() - received_at)
+                # Add the bot's response to the user's chat history
+                await self.add_chat_history(user_id, "assistant", response_text)
+
+        except ignored_errors:
+            pass
+        except Exception as e:
+            print(f"Error occurred while processing message after all retries: {e}")
+            await channel.send("I'm sorry, there was an issue processing your request. Please try again later.")
+        finally:
+            if reply is not None:
+                await reply.close()
+
+    def register_metrics(self, registry):
+        # Existing counters are read when /metrics is scraped rather than mirrored on every call
+        registry.callback('bot_request_queue_depth', 'Requests waiting for a worker.', self.request_scheduler.depth)
+        registry.callback('bot_completion_retries_total', 'Completion calls retried, by error kind.',
+                          lambda: {(kind,): count for kind, count in self.retry_policy.retries.items()},
+                          kind='counter', labelnames=('kind',))
+        registry.callback('bot_completion_failures_total', 'Failed completion attempts, by error kind.',
+                          lambda: {(kind,): count for kind, count in self.retry_policy.failures.items()},
+                          kind='counter', labelnames=('kind',))
+        registry.callback('bot_completion_rejected_total', 'Completion calls refused while the circuit breaker was open.',
+                          lambda: self.retry_policy.rejected, kind='counter')
+        registry.callback('bot_circuit_open', 'Whether the OpenAI circuit breaker is open (1) or not (0).',
+                          lambda: int(self.circuit_breaker.state == 'open'))
+        registry.callback('bot_embedding_cache_lookups_total', 'Embedding cache lookups, by result.',
+                          lambda: {(result,): self.embedding_cache.stats()[result]
+                                   for result in ('hits', 'disk_hits', 'misses')},
+                          kind='counter', labelnames=('result',))
+        registry.callback('bot_embedding_cache_hit_ratio', 'Share of embedding lookups served from the cache.',
+                          lambda: self.embedding_cache.stats()['hit_rate'])
+        registry.callback('bot_write_behind_jobs', 'Ended conversations not yet saved and indexed.',
+                          lambda: len(self.write_behind))
+        registry.callback('bot_sessions', 'Conversations held in memory.', lambda: len(self.sessions))
+        registry.callback('bot_session_memory_bytes', 'Estimated memory used by in-memory conversations.',
+                          lambda: self.sessions.estimated_bytes)
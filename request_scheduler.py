@@ -0,0 +1,176 @@
+# --------------------
+# Request scheduler
+# --------------------
+# Fixed pool of worker tasks pulling from per-user queues. A worker picks up
+# the next request as soon as it finishes its current one, users are served
+# round-robin so one busy user can't starve the rest, and the total number of
+# waiting requests is bounded so submitters are held back once it fills up.
+import time
+import asyncio
+from collections import deque
+
+
+class FairScheduler:
+    def __init__(self, handler, workers=30, max_queue=200):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queues = {}
+        self._ready = deque()
+        self._pending = 0
+        self._condition = asyncio.Condition()
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self):
+        return self._pending
+
+    async def submit(self, user_id, *args):
+        """Queue handler(user_id, *args) and return a future for its result, waiting while the queue is full."""
+        response_future = asyncio.get_running_loop().create_future()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._pending < self.max_queue)
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._ready.append(user_id)
+            queue.append((args, response_future, time.monotonic()))
+            self._pending += 1
+            self._condition.notify_all()
+        return response_future
+
+    async def _next_request(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._ready)
+            user_id = self._ready.popleft()
+            queue = self._queues[user_id]
+            request = queue.popleft()
+            if queue:
+                self._ready.append(user_id)  # back of the line behind every other waiting user
+            else:
+                del self._queues[user_id]
+            self._pending -= 1
+            self._condition.notify_all()
+        return user_id, request
+
+    async def _worker(self):
+        while True:
+            user_id, (args, response_future, enqueued_at) = await self._next_request()
+            if response_future.cancelled():
+                continue
+            self.on_start(user_id, time.monotonic() - enqueued_at)
+            try:
+                result = await self.handler(user_id, *args)
+            except asyncio.CancelledError:
+                response_future.cancel()
+                raise
+            except Exception as e:
+                if not response_future.done():
+                    response_future.set_exception(e)
+            else:
+                if not response_future.done():
+                    response_future.set_result(result)
+
+    def on_start(self, user_id, queue_wait):
+        """Hook called when a request leaves the queue; queue_wait is in seconds."""
+
+
+class SharedRequestError(Exception):
+    """A request run by another worker process failed; carries that worker's error message."""
+
+
+class SharedQueueScheduler:
+    # Same interface as FairScheduler, but requests go through a SharedStore
+    # (see shared_state.py) so any worker process can run them. One dispatcher
+    # task claims work while fewer than `workers` requests are running here,
+    # and one poller hands finished results back to local submitters. Store
+    # calls go through its async methods so they never block the loop.
+    # Arguments and results must be JSON-serializable.
+    def __init__(self, handler, store, worker_id, workers=30, max_queue=200, poll_interval=0.05):
+        self.handler = handler
+        self.store = store
+        self.worker_id = worker_id
+        self.workers = workers
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self._waiting = {}
+        self._running = set()
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._dispatch()), asyncio.create_task(self._collect())]
+
+    async def stop(self):
+        for task in self._tasks + list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._running, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self):
+        return self.store.queue_depth()
+
+    async def submit(self, user_id, *args):
+        """Queue handler(user_id, *args) and return a future for its result, waiting while the queue is full."""
+        while await self.store.aqueue_depth() >= self.max_queue:
+            await asyncio.sleep(self.poll_interval)
+        request_id = await self.store.aenqueue_request(user_id, {"user_id": user_id, "args": list(args),
+                                                          "enqueued": time.time()})
+        response_future = self._waiting[request_id] = asyncio.get_running_loop().create_future()
+        return response_future
+
+    async def _dispatch(self):
+        # Requests this worker was running before a restart go back in the queue first
+        await self.store.arecover_worker(self.worker_id)
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            await slots.acquire()
+            claimed = await self.store.aclaim_request(self.worker_id)
+            if claimed is None:
+                slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+            task = asyncio.create_task(self._run(*claimed))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _run(self, request_id, _, payload):
+        self.on_start(payload["user_id"], max(0.0, time.time() - payload["enqueued"]))
+        try:
+            result = await self.handler(payload["user_id"], *payload["args"])
+        except asyncio.CancelledError:
+            raise  # left running; recover_worker requeues it when this worker comes back
+        except Exception as e:
+            await self.store.afinish_request(request_id, error=f"{type(e).__name__}: {e}")
+        else:
+            await self.store.afinish_request(request_id, result=result)
+
+    async def _collect(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self._waiting:
+                continue
+            outcomes = await self.store.arequest_outcome(list(self._waiting))
+            for request_id, (status, result, error) in outcomes.items():
+                response_future = self._waiting.pop(request_id)
+                if response_future.done():
+                    continue
+                if error is not None:
+                    response_future.set_exception(SharedRequestError(error))
+                else:
+                    response_future.set_result(result)
+
+    def on_start(self, user_id, queue_wait):
+        """Hook called when a request leaves the queue; queue_wait is in seconds."""
@@ -0,0 +1,141 @@
+# --------------------
+# Retry policy
+# --------------------
+# Retries for upstream API calls. Errors are classified as rate limits,
+# timeouts (which also covers dropped connections and 5xx responses) or fatal
+# errors; only the first two are retried, with jittered exponential backoff
+# or the server's Retry-After when it sends one. A circuit breaker shared by
+# every caller of the same upstream opens after repeated failures, so while
+# the upstream is down requests fail fast instead of piling on more retries.
+import time
+import random
+import asyncio
+
+import aiohttp
+import openai
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+FATAL = "fatal"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def classify_error(e):
+    if isinstance(e, openai.error.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(e, (openai.error.Timeout, openai.error.APIConnectionError, openai.error.ServiceUnavailableError,
+                      openai.error.TryAgain, asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return TIMEOUT
+    if isinstance(e, openai.error.APIError) and (e.http_status or 500) >= 500:
+        return TIMEOUT
+    if isinstance(e, aiohttp.ClientResponseError):
+        if e.status == 429:
+            return RATE_LIMIT
+        if e.status >= 500:
+            return TIMEOUT
+    return FATAL
+
+
+def retry_after(e):
+    """Seconds the server asked us to wait, if it said."""
+    headers = getattr(e, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_in_flight):
+            raise CircuitOpenError("upstream circuit is open, failing fast")
+        if state == "half_open":
+            self.trial_in_flight = True  # let a single trial request through
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give up a half-open trial without a verdict (e.g. the call failed for an unrelated reason)."""
+        self.trial_in_flight = False
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = {RATE_LIMIT: 0, TIMEOUT: 0}
+        self.failures = {RATE_LIMIT: 0, TIMEOUT: 0, FATAL: 0}
+        self.rejected = 0
+
+    async def run(self, fn):
+        """Await fn() until it succeeds, retrying rate limits and timeouts."""
+        for attempt in range(self.max_attempts):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.rejected += 1
+                raise
+            try:
+                result = await fn()
+            except Exception as e:
+                kind = classify_error(e)
+                self.failures[kind] += 1
+                if kind == FATAL:
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                elif delay > self.max_delay:
+                    raise  # retrying early would only be throttled again
+                self.retries[kind] += 1
+                print(f"{kind} error, retry attempt {attempt + 1} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled (or interrupted) mid-call: free a half-open trial so the breaker can close again
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
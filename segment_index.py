@@ -0,0 +1,116 @@
+# --------------------
+# Segment index
+# --------------------
+# Maps a chat-log segment UUID (the id we upsert to Pinecone) to the user it
+# belongs to, the file it was written to and the segment messages themselves,
+# so a Pinecone hit can be resolved with a single keyed lookup instead of
+# probing every user folder under chat_logs.
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+import chat_store
+
+SEGMENT_INDEX_FILE = "segment_index.db"
+
+_connections = {}
+_lock = threading.Lock()
+
+
+def _index_path(chat_logs_folder):
+    return os.path.join(chat_logs_folder, SEGMENT_INDEX_FILE)
+
+
+def open_index(chat_logs_folder="chat_logs"):
+    path = _index_path(chat_logs_folder)
+    with _lock:
+        conn = _connections.get(path)
+        if conn is None:
+            os.makedirs(chat_logs_folder, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                "unique_id TEXT PRIMARY KEY, "
+                "user_id TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "chat_history TEXT NOT NULL)"
+            )
+            conn.commit()
+            _connections[path] = conn
+        return conn
+
+
+def add_segments(records, chat_logs_folder="chat_logs"):
+    """Index (unique_id, user_id, path, chat_history) tuples."""
+    rows = [(unique_id, str(user_id), path, json.dumps(chat_history))
+            for unique_id, user_id, path, chat_history in records]
+    if not rows:
+        return
+    conn = open_index(chat_logs_folder)
+    with _lock:
+        conn.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+
+
+def add_segment(unique_id, user_id, path, chat_history, chat_logs_folder="chat_logs"):
+    add_segments([(unique_id, user_id, path, chat_history)], chat_logs_folder)
+
+
+def lookup_segments(unique_ids, chat_logs_folder="chat_logs"):
+    """Return {unique_id: {"user_id", "path", "chat_history"}} for the ids that are indexed."""
+    unique_ids = list(unique_ids)
+    if not unique_ids:
+        return {}
+    conn = open_index(chat_logs_folder)
+    placeholders = ",".join("?" * len(unique_ids))
+    with _lock:
+        rows = conn.execute(
+            f"SELECT unique_id, user_id, path, chat_history FROM segments WHERE unique_id IN ({placeholders})",
+            unique_ids,
+        ).fetchall()
+    return {
+        unique_id: {"user_id": user_id, "path": path, "chat_history": json.loads(chat_history)}
+        for unique_id, user_id, path, chat_history in rows
+    }
+
+
+def find_segment_file(unique_id, chat_logs_folder="chat_logs"):
+    """Slow path: probe every user folder for <unique_id>.json (used for ids missing from the index)."""
+    if not os.path.isdir(chat_logs_folder):
+        return None
+    for user_folder in os.listdir(chat_logs_folder):
+        folder_path = os.path.join(chat_logs_folder, user_folder)
+        if not os.path.isdir(folder_path):
+            continue
+        file_path = os.path.join(folder_path, f"{unique_id}.json")
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+
+def rebuild_index(chat_logs_folder="chat_logs", batch_size=1000):
+    """Index every <user>/<uuid>.json segment already on disk. Returns the number indexed."""
+    count = 0
+    batch = []
+    for file_path, chat_log in chat_store.iter_chat_log_files(chat_logs_folder):
+        metadata = chat_log["metadata"]
+        batch.append((metadata["unique_id"], metadata["user_id"], file_path, chat_log["chat_history"]))
+        if len(batch) >= batch_size:
+            add_segments(batch, chat_logs_folder)
+            count += len(batch)
+            batch = []
+    add_segments(batch, chat_logs_folder)
+    count += len(batch)
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("usage: python segment_index.py rebuild [chat_logs_folder]")
+        sys.exit(1)
+    folder = sys.argv[2] if len(sys.argv) > 2 else "chat_logs"
+    print(f"Indexed {rebuild_index(folder)} segments from {folder}")
@@ -0,0 +1,187 @@
+# --------------------
+# Session manager
+# --------------------
+# Bounded in-memory store for each user's recent conversation. Sessions are
+# kept in least-recently-used order; any session idle for longer than the TTL,
+# and the least recently used ones whenever the estimated memory use goes over
+# the cap, are evicted and handed to an on_evict callback (the bot saves them
+# through the normal save path) instead of being dropped. With a shared store
+# (see shared_state.py) the store holds the authoritative copy: every change is
+# written through and reads refresh from it, so any worker process can serve
+# the user. Eviction then only drops this worker's cached copy: idle times are
+# per worker, and ending the conversation (saving and deleting the shared
+# copy) is left to the worker that owns it, through !end or its inactivity
+# timer. The a* methods are the event-loop versions: they do the same work but
+# wait for the store without blocking the loop.
+import sys
+import time
+from collections import OrderedDict
+
+ROLES = ("user", "assistant", "system")
+MESSAGE_OVERHEAD_BYTES = 72  # the (role index, content) tuple and its list slot
+SESSION_OVERHEAD_BYTES = 250  # the Session record, its history list and the OrderedDict entry
+
+
+def _message_bytes(content):
+    return sys.getsizeof(content) + MESSAGE_OVERHEAD_BYTES
+
+
+class Session:
+    # Messages are stored as (role index, content) tuples rather than dicts to keep records small
+    __slots__ = ("history", "last_active", "size")
+
+    def __init__(self):
+        self.history = []
+        self.last_active = time.monotonic()
+        self.size = 0
+
+
+class SessionManager:
+    def __init__(self, max_history=6, ttl=60 * 60, memory_limit=64 * 1024 * 1024, on_evict=None, store=None):
+        self.max_history = max_history
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        self.on_evict = on_evict
+        self.store = store
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._size = 0
+
+    def __contains__(self, user_id):
+        return self._load(user_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _touch(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = Session()
+            self._size += SESSION_OVERHEAD_BYTES
+        session.last_active = time.monotonic()
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def _replace(self, session, history):
+        self._size -= session.size
+        session.history = history[-self.max_history:]
+        session.size = sum(_message_bytes(content) for _, content in session.history)
+        self._size += session.size
+
+    def _refresh(self, user_id, messages):
+        # The shared store is authoritative: another worker may have changed or ended the session
+        if not messages:
+            self._drop(user_id)
+            return None
+        session = self._touch(user_id)
+        self._replace(session, [(ROLES.index(message["role"]), message["content"]) for message in messages])
+        return session
+
+    def _load(self, user_id):
+        if self.store is None:
+            return self._sessions.get(user_id)
+        return self._refresh(user_id, self.store.load_session(user_id))
+
+    async def _aload(self, user_id):
+        if self.store is None:
+            return self._sessions.get(user_id)
+        return self._refresh(user_id, await self.store.aload_session(user_id))
+
+    def _drop(self, user_id):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._size -= session.size + SESSION_OVERHEAD_BYTES
+
+    def _formatted(self, session):
+        if session is None:
+            return []
+        return [{"role": ROLES[role], "content": content} for role, content in session.history]
+
+    def _write_through(self, user_id, session):
+        if self.store is not None:
+            self.store.save_session(user_id, self._formatted(session))
+
+    async def _awrite_through(self, user_id, session):
+        if self.store is not None:
+            await self.store.asave_session(user_id, self._formatted(session))
+
+    def messages(self, user_id):
+        """The user's recent messages in ChatCompletion format (empty if there is no session)."""
+        return self._formatted(self._load(user_id))
+
+    async def amessages(self, user_id):
+        return self._formatted(await self._aload(user_id))
+
+    def _set(self, user_id, messages):
+        session = self._touch(user_id)
+        self._replace(session, [(ROLES.index(message["role"]), message["content"]) for message in messages])
+        return session
+
+    def _add(self, user_id, role, content):
+        session = self._touch(user_id)
+        self._replace(session, session.history + [(ROLES.index(role), content)])
+        return session
+
+    def set_history(self, user_id, messages):
+        self._write_through(user_id, self._set(user_id, messages))
+        self.evict()
+
+    async def aset_history(self, user_id, messages):
+        await self._awrite_through(user_id, self._set(user_id, messages))
+        self.evict()
+
+    def append(self, user_id, role, content):
+        self._load(user_id)
+        self._write_through(user_id, self._add(user_id, role, content))
+        self.evict()
+
+    async def aappend(self, user_id, role, content):
+        await self._aload(user_id)
+        await self._awrite_through(user_id, self._add(user_id, role, content))
+        self.evict()
+
+    def pop(self, user_id):
+        """Remove a session and return its messages (empty if there was none)."""
+        messages = self.messages(user_id)
+        self._drop(user_id)
+        if self.store is not None:
+            self.store.delete_session(user_id)
+        return messages
+
+    async def apop(self, user_id):
+        messages = await self.amessages(user_id)
+        self._drop(user_id)
+        if self.store is not None:
+            await self.store.adelete_session(user_id)
+        return messages
+
+    def evict(self):
+        """Evict expired sessions, then least recently used ones until under the memory cap."""
+        now = time.monotonic()
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.ttl and self._size <= self.memory_limit:
+                break
+            if self.store is not None:
+                # Another worker may be serving this conversation right now; leave the shared copy alone
+                self._drop(user_id)
+                self.evictions += 1
+                continue
+            messages = self.pop(user_id)
+            self.evictions += 1
+            if self.on_evict is not None and messages:
+                self.on_evict(user_id, messages)
+
+    @property
+    def estimated_bytes(self):
+        """Running size estimate; cheap and safe to read from another thread, unlike memory_stats."""
+        return self._size
+
+    def memory_stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "messages": sum(len(session.history) for session in self._sessions.values()),
+            "estimated_bytes": self.estimated_bytes,
+            "memory_limit": self.memory_limit,
+            "evictions": self.evictions,
+        }
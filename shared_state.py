@@ -0,0 +1,380 @@
+# --------------------
+# Shared state store
+# --------------------
+# State that every bot worker has to agree on when shards are spread across
+# processes: global flags (!sleep / !wake), which users have an open
+# conversation, per-user session snapshots and the request queue.
+# LocalSharedStore keeps it in memory for the single-process bot;
+# SqliteSharedStore keeps it in one SQLite file that all workers on the host
+# open, using short IMMEDIATE transactions for anything that must be atomic.
+# Code on the event loop uses the a* versions of each call, which run the
+# SQLite work on the blocking-I/O pool, so a worker waiting on another
+# worker's write lock never stalls the loop (or the Discord heartbeat).
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+
+from async_clients import run_blocking
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class SharedStore:
+    def get_flag(self, name, default=False):
+        raise NotImplementedError
+
+    def set_flag(self, name, value):
+        raise NotImplementedError
+
+    def claim_conversation(self, user_id, owner):
+        """Mark a user's conversation as open. Returns False if one is already open."""
+        raise NotImplementedError
+
+    def release_conversation(self, user_id):
+        raise NotImplementedError
+
+    def is_conversation_active(self, user_id):
+        raise NotImplementedError
+
+    def release_conversations(self, owner):
+        """Release every conversation an owner holds, e.g. when a worker restarts and its timers are gone."""
+        raise NotImplementedError
+
+    def load_session(self, user_id):
+        raise NotImplementedError
+
+    def save_session(self, user_id, messages):
+        raise NotImplementedError
+
+    def delete_session(self, user_id):
+        raise NotImplementedError
+
+    def enqueue_request(self, user_id, payload):
+        """Queue a JSON-serializable payload for a user and return its request id."""
+        raise NotImplementedError
+
+    def claim_request(self, worker):
+        """Take the oldest queued request whose user has nothing running. Returns (id, user_id, payload) or None."""
+        raise NotImplementedError
+
+    def finish_request(self, request_id, result=None, error=None):
+        raise NotImplementedError
+
+    def request_outcome(self, request_ids):
+        """Return {request_id: (status, result, error)} for finished requests among request_ids."""
+        raise NotImplementedError
+
+    def recover_worker(self, worker, max_age=60 * 60):
+        """Requeue a restarted worker's unfinished requests and drop old results nobody collected."""
+        raise NotImplementedError
+
+    def queue_depth(self):
+        raise NotImplementedError
+
+    # --------------------
+    # Async versions for the event loop
+    # --------------------
+    async def _call(self, fn, *args):
+        return await run_blocking(fn, *args)
+
+    async def aget_flag(self, name, default=False):
+        return await self._call(self.get_flag, name, default)
+
+    async def aset_flag(self, name, value):
+        await self._call(self.set_flag, name, value)
+
+    async def aclaim_conversation(self, user_id, owner):
+        return await self._call(self.claim_conversation, user_id, owner)
+
+    async def arelease_conversation(self, user_id):
+        await self._call(self.release_conversation, user_id)
+
+    async def ais_conversation_active(self, user_id):
+        return await self._call(self.is_conversation_active, user_id)
+
+    async def aload_session(self, user_id):
+        return await self._call(self.load_session, user_id)
+
+    async def asave_session(self, user_id, messages):
+        await self._call(self.save_session, user_id, messages)
+
+    async def adelete_session(self, user_id):
+        await self._call(self.delete_session, user_id)
+
+    async def aenqueue_request(self, user_id, payload):
+        return await self._call(self.enqueue_request, user_id, payload)
+
+    async def aclaim_request(self, worker):
+        return await self._call(self.claim_request, worker)
+
+    async def afinish_request(self, request_id, result=None, error=None):
+        await self._call(self.finish_request, request_id, result, error)
+
+    async def arequest_outcome(self, request_ids):
+        return await self._call(self.request_outcome, request_ids)
+
+    async def arecover_worker(self, worker, max_age=60 * 60):
+        await self._call(self.recover_worker, worker, max_age)
+
+    async def aqueue_depth(self):
+        return await self._call(self.queue_depth)
+
+
+class LocalSharedStore(SharedStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flags = {}
+        self._conversations = {}
+        self._sessions = {}
+        self._requests = {}
+        self._queue = deque()
+        self._running_users = set()
+        self._next_id = 1
+
+    def get_flag(self, name, default=False):
+        return self._flags.get(name, default)
+
+    def set_flag(self, name, value):
+        self._flags[name] = value
+
+    def claim_conversation(self, user_id, owner):
+        with self._lock:
+            if user_id in self._conversations:
+                return False
+            self._conversations[user_id] = owner
+            return True
+
+    def release_conversation(self, user_id):
+        self._conversations.pop(user_id, None)
+
+    def is_conversation_active(self, user_id):
+        return user_id in self._conversations
+
+    def release_conversations(self, owner):
+        with self._lock:
+            for user_id in [user_id for user_id, holder in self._conversations.items() if holder == owner]:
+                del self._conversations[user_id]
+
+    def load_session(self, user_id):
+        return list(self._sessions.get(user_id, []))
+
+    def save_session(self, user_id, messages):
+        self._sessions[user_id] = list(messages)
+
+    def delete_session(self, user_id):
+        self._sessions.pop(user_id, None)
+
+    def enqueue_request(self, user_id, payload):
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._requests[request_id] = [user_id, payload, QUEUED, None, None]
+            self._queue.append(request_id)
+            return request_id
+
+    def claim_request(self, worker):
+        with self._lock:
+            for request_id in self._queue:
+                user_id, payload = self._requests[request_id][:2]
+                if user_id not in self._running_users:
+                    self._queue.remove(request_id)
+                    self._running_users.add(user_id)
+                    self._requests[request_id][2] = RUNNING
+                    return request_id, user_id, payload
+            return None
+
+    def finish_request(self, request_id, result=None, error=None):
+        with self._lock:
+            request = self._requests[request_id]
+            self._running_users.discard(request[0])
+            request[2:] = [FAILED if error is not None else DONE, result, error]
+
+    def request_outcome(self, request_ids):
+        outcomes = {}
+        with self._lock:
+            for request_id in request_ids:
+                request = self._requests.get(request_id)
+                if request is not None and request[2] in (DONE, FAILED):
+                    outcomes[request_id] = tuple(request[2:])
+                    del self._requests[request_id]
+        return outcomes
+
+    def recover_worker(self, worker, max_age=60 * 60):
+        pass  # in-memory state does not outlive the process
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    async def _call(self, fn, *args):
+        return fn(*args)  # in memory, nothing to wait on
+
+
+class SqliteSharedStore(SharedStore):
+    def __init__(self, path=os.path.join("chat_logs", "shared_state.db"), flag_cache_ttl=1.0):
+        self.path = path
+        self.flag_cache_ttl = flag_cache_ttl
+        self._flag_cache = {}
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS flags (name TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS conversations (user_id TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+            "started REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, messages TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS requests (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL, worker TEXT, result TEXT, error TEXT, "
+            "created REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS requests_status ON requests (status, id);"
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _cached_flag(self, name):
+        # Flags are read on every message; a short cache keeps that off the database
+        cached = self._flag_cache.get(name)
+        if cached is not None and time.monotonic() - cached[1] < self.flag_cache_ttl:
+            return cached
+        return None
+
+    def get_flag(self, name, default=False):
+        cached = self._cached_flag(name)
+        if cached is not None:
+            return cached[0]
+        rows = self._execute("SELECT value FROM flags WHERE name = ?", (name,))
+        value = json.loads(rows[0][0]) if rows else default
+        self._flag_cache[name] = (value, time.monotonic())
+        return value
+
+    async def aget_flag(self, name, default=False):
+        cached = self._cached_flag(name)
+        if cached is not None:
+            return cached[0]
+        return await super().aget_flag(name, default)
+
+    def set_flag(self, name, value):
+        self._execute("INSERT OR REPLACE INTO flags VALUES (?, ?)", (name, json.dumps(value)))
+        self._flag_cache[name] = (value, time.monotonic())
+
+    def claim_conversation(self, user_id, owner):
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO conversations VALUES (?, ?, ?)",
+                                        (str(user_id), str(owner), time.time()))
+            return cursor.rowcount == 1
+
+    def release_conversation(self, user_id):
+        self._execute("DELETE FROM conversations WHERE user_id = ?", (str(user_id),))
+
+    def is_conversation_active(self, user_id):
+        return bool(self._execute("SELECT 1 FROM conversations WHERE user_id = ?", (str(user_id),)))
+
+    def release_conversations(self, owner):
+        self._execute("DELETE FROM conversations WHERE owner = ?", (str(owner),))
+
+    def load_session(self, user_id):
+        rows = self._execute("SELECT messages FROM sessions WHERE user_id = ?", (str(user_id),))
+        return json.loads(rows[0][0]) if rows else []
+
+    def save_session(self, user_id, messages):
+        self._execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (str(user_id), json.dumps(messages)))
+
+    def delete_session(self, user_id):
+        self._execute("DELETE FROM sessions WHERE user_id = ?", (str(user_id),))
+
+    def enqueue_request(self, user_id, payload):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO requests (user_id, payload, status, created) VALUES (?, ?, ?, ?)",
+                (str(user_id), json.dumps(payload), QUEUED, time.time()))
+            return cursor.lastrowid
+
+    def claim_request(self, worker):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, user_id, payload FROM requests WHERE status = ? AND user_id NOT IN "
+                    "(SELECT user_id FROM requests WHERE status = ?) ORDER BY id LIMIT 1",
+                    (QUEUED, RUNNING)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE requests SET status = ?, worker = ? WHERE id = ?",
+                                       (RUNNING, str(worker), row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        request_id, user_id, payload = row
+        return request_id, user_id, json.loads(payload)
+
+    def finish_request(self, request_id, result=None, error=None):
+        self._execute("UPDATE requests SET status = ?, result = ?, error = ? WHERE id = ?",
+                      (FAILED if error is not None else DONE, json.dumps(result), error, request_id))
+
+    def request_outcome(self, request_ids):
+        request_ids = list(request_ids)
+        if not request_ids:
+            return {}
+        placeholders = ",".join("?" * len(request_ids))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT id, status, result, error FROM requests WHERE id IN ({placeholders}) "
+                    f"AND status IN (?, ?)", request_ids + [DONE, FAILED]).fetchall()
+                if rows:
+                    done = [row[0] for row in rows]
+                    self._conn.execute(f"DELETE FROM requests WHERE id IN ({','.join('?' * len(done))})", done)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {request_id: (status, json.loads(result) if result is not None else None, error)
+                for request_id, status, result, error in rows}
+
+    def recover_worker(self, worker, max_age=60 * 60):
+        self._execute("UPDATE requests SET status = ?, worker = NULL WHERE status = ? AND worker = ?",
+                      (QUEUED, RUNNING, str(worker)))
+        self._execute("DELETE FROM requests WHERE status IN (?, ?) AND created < ?",
+                      (DONE, FAILED, time.time() - max_age))
+
+    def queue_depth(self):
+        return self._execute("SELECT COUNT(*) FROM requests WHERE status = ?", (QUEUED,))[0][0]
+
+
+def get_shared_store(backend=None):
+    backend = backend or os.environ.get("SHARED_STATE", "local")
+    if backend == "local":
+        return LocalSharedStore()
+    if backend == "sqlite":
+        return SqliteSharedStore(os.environ.get("SHARED_STATE_PATH", os.path.join("chat_logs", "shared_state.db")))
+    raise ValueError(f"Unknown shared state backend: {backend}")
+
+
+def check_worker_backends(shared_state, chat_store, vector_store):
+    """Refuse backends that can't be shared by several worker processes.
+
+    The json chat store and the local vector store append rows and manifest lines at positions each
+    process tracks in memory, so two workers on the same folder would overwrite each other.
+    """
+    if shared_state == "local":
+        return
+    if chat_store != "sqlite":
+        raise ValueError(f"SHARED_STATE={shared_state} needs CHAT_STORE=sqlite, not {chat_store} "
+                         "(import existing json logs with: python chat_store.py migrate)")
+    if vector_store == "local":
+        raise ValueError(f"SHARED_STATE={shared_state} needs a vector store the workers can share, "
+                         "VECTOR_STORE=local can only be used by a single process")
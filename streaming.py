@@ -0,0 +1,109 @@
+# --------------------
+# Streaming replies
+# --------------------
+# Turns a streamed ChatCompletion into a Discord message that appears as soon
+# as the first tokens arrive and is then edited in place as more text comes
+# in. Edits run from one background task at a fixed cadence, so tokens that
+# arrive while an edit is in flight (or while discord.py is waiting out a rate
+# limit) are coalesced into the next edit instead of queueing up.
+import time
+import asyncio
+
+DISCORD_MESSAGE_LIMIT = 2000
+EDIT_INTERVAL = 1.0  # Discord allows roughly 5 edits per 5 seconds per channel
+FIRST_POST_CHARS = 20
+FIRST_POST_DELAY = 0.5
+
+
+async def stream_completion_text(stream):
+    """Yield the text deltas from a streamed ChatCompletion response."""
+    async for chunk in stream:
+        choices = chunk['choices']
+        if not choices:
+            continue
+        content = choices[0].get('delta', {}).get('content')
+        if content:
+            yield content
+
+
+class StreamingReply:
+    def __init__(self, channel, edit_interval=EDIT_INTERVAL, first_post_chars=FIRST_POST_CHARS,
+                 first_post_delay=FIRST_POST_DELAY):
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.first_post_chars = first_post_chars
+        self.first_post_delay = first_post_delay
+        self.text = ""
+        self.messages = []
+        self.first_post_at = None
+        self._shown = []
+        self._started = None
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._flusher = None
+
+    @property
+    def started(self):
+        return self._started is not None
+
+    async def feed(self, delta):
+        if self._started is None:
+            self._started = time.monotonic()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self.text += delta
+        self._dirty.set()
+
+    def _pages(self, text):
+        text = text or "..."
+        return [text[i:i + DISCORD_MESSAGE_LIMIT] for i in range(0, len(text), DISCORD_MESSAGE_LIMIT)]
+
+    async def _render(self, text):
+        pages = self._pages(text)
+        for i, page in enumerate(pages):
+            if i < len(self.messages):
+                if self._shown[i] != page:
+                    await self.messages[i].edit(content=page)
+                    self._shown[i] = page
+            else:
+                self.messages.append(await self.channel.send(page))
+                self._shown.append(page)
+                if self.first_post_at is None:
+                    self.first_post_at = time.monotonic()
+
+    async def _flush_loop(self):
+        # Hold the first post briefly so it isn't a single token, then edit at a steady cadence
+        while not self.messages:
+            await self._dirty.wait()
+            while len(self.text.strip()) < self.first_post_chars:
+                remaining = self.first_post_delay - (time.monotonic() - self._started)
+                if remaining <= 0:
+                    break
+                self._dirty.clear()
+                try:
+                    await asyncio.wait_for(self._dirty.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            self._dirty.clear()
+            if self.text.strip():
+                async with self._lock:
+                    await self._render(self.text)
+        while True:
+            await asyncio.sleep(self.edit_interval)
+            await self._dirty.wait()
+            self._dirty.clear()
+            async with self._lock:
+                await self._render(self.text)
+
+    async def close(self):
+        if self._flusher is not None:
+            # Never cancel the flusher mid-send, or a posted message could go untracked
+            async with self._lock:
+                self._flusher.cancel()
+                await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+
+    async def finish(self, final_text):
+        """Stop streaming and make sure the posted message(s) show the final text."""
+        await self.close()
+        self.text = final_text
+        await self._render(final_text)
@@ -0,0 +1,166 @@
+# --------------------
+# Vector store
+# --------------------
+# Small interface over the vector index used for conversation recall, with
+# two implementations: PineconeVectorStore wraps a remote pinecone.Index, and
+# LocalVectorStore keeps each namespace as an in-process float32 matrix backed
+# by a memory-mapped file, answering queries with a vectorized cosine top-k.
+# The async methods are what the bot calls; they never block the event loop.
+import os
+import re
+import threading
+
+import numpy as np
+
+from async_clients import run_blocking
+
+
+class VectorStore:
+    def upsert(self, vectors, namespace):
+        """Insert or overwrite (unique_id, vector) pairs in a namespace."""
+        raise NotImplementedError
+
+    def query(self, vector, top_k, namespace):
+        """Return the top_k (unique_id, score) matches for a vector, best first."""
+        raise NotImplementedError
+
+    async def aupsert(self, vectors, namespace):
+        await run_blocking(self.upsert, vectors, namespace)
+
+    async def aquery(self, vector, top_k, namespace):
+        return await run_blocking(self.query, vector, top_k, namespace)
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index, async_index=None):
+        self.index = index
+        self.async_index = async_index
+
+    def upsert(self, vectors, namespace):
+        self.index.upsert(vectors, namespace=namespace)
+
+    def query(self, vector, top_k, namespace):
+        query_results = self.index.query(vector=list(vector), top_k=top_k, namespace=namespace)
+        return [(match['id'], match['score']) for match in query_results['matches']]
+
+    async def aupsert(self, vectors, namespace):
+        if self.async_index is None:
+            return await super().aupsert(vectors, namespace)
+        await self.async_index.upsert(vectors, namespace)
+
+    async def aquery(self, vector, top_k, namespace):
+        if self.async_index is None:
+            return await super().aquery(vector, top_k, namespace)
+        return await self.async_index.query(vector, top_k, namespace)
+
+
+class _Partition:
+    """One namespace: <name>.f32 holds normalized vectors row by row, <name>.ids the id of each row."""
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, folder, name, dimension):
+        self.vectors_path = os.path.join(folder, f"{name}.f32")
+        self.ids_path = os.path.join(folder, f"{name}.ids")
+        self.dimension = dimension
+        self.ids = []
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, "r") as f:
+                self.ids = [line.strip() for line in f if line.strip()]
+        self.rows = {unique_id: row for row, unique_id in enumerate(self.ids)}
+        # The vector file is preallocated, so its size is the capacity rather than the number of rows
+        file_rows = os.path.getsize(self.vectors_path) // (4 * dimension) if os.path.exists(self.vectors_path) else 0
+        self.capacity = 0
+        self.matrix = None
+        self._open(max(file_rows, len(self.ids), self.INITIAL_CAPACITY))
+
+    def _open(self, capacity):
+        if self.matrix is not None:
+            self.matrix.flush()
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(max(capacity * 4 * self.dimension, os.path.getsize(self.vectors_path)))
+        # Map the grown file before swapping it in, so self.matrix is never left unset
+        matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        self.matrix = matrix
+        self.capacity = capacity
+
+    def upsert(self, unique_ids, vectors):
+        new_ids = []
+        for unique_id, vector in zip(unique_ids, vectors):
+            row = self.rows.get(unique_id)
+            if row is None:
+                if len(self.ids) >= self.capacity:
+                    self._open(self.capacity * 2)
+                row = len(self.ids)
+                self.ids.append(unique_id)
+                self.rows[unique_id] = row
+                new_ids.append(unique_id)
+            self.matrix[row] = vector
+        self.matrix.flush()
+        if new_ids:
+            with open(self.ids_path, "a") as f:
+                f.write("".join(f"{unique_id}\n" for unique_id in new_ids))
+
+    def query(self, vector, top_k):
+        count = len(self.ids)
+        if count == 0:
+            return []
+        scores = self.matrix[:count] @ vector
+        top_k = min(top_k, count)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[row], float(scores[row])) for row in best]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, folder="vector_store", dimension=1536):
+        self.folder = folder
+        self.dimension = dimension
+        self._partitions = {}
+        # aupsert/aquery run on the blocking-I/O pool; one lock keeps a partition from being
+        # resized or appended to while another thread reads or writes it
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _partition(self, namespace):
+        # Called with self._lock held
+        partition = self._partitions.get(namespace)
+        if partition is None:
+            name = re.sub(r'[^A-Za-z0-9_-]', '_', namespace)
+            partition = _Partition(self.folder, name, self.dimension)
+            self._partitions[namespace] = partition
+        return partition
+
+    def upsert(self, vectors, namespace):
+        vectors = list(vectors)
+        if not vectors:
+            return
+        unique_ids = [unique_id for unique_id, _ in vectors]
+        normalized = _normalize([vector for _, vector in vectors])
+        with self._lock:
+            self._partition(namespace).upsert(unique_ids, normalized)
+
+    def query(self, vector, top_k, namespace):
+        normalized = _normalize(vector)
+        with self._lock:
+            return self._partition(namespace).query(normalized, top_k)
+
+    def count(self, namespace):
+        with self._lock:
+            return len(self._partition(namespace).ids)
+
+
+def get_vector_store(backend=None, pinecone_index=None, async_pinecone_index=None):
+    backend = backend or os.environ.get("VECTOR_STORE", "pinecone")
+    if backend == "pinecone":
+        return PineconeVectorStore(pinecone_index, async_pinecone_index)
+    if backend == "local":
+        return LocalVectorStore(os.environ.get("VECTOR_STORE_DIR", "vector_store"))
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -0,0 +1,321 @@
+# --------------------
+# Write-behind persistence
+# --------------------
+# Ending a conversation appends its transcript to a local write-ahead log and
+# returns; a background task then saves the segments to the chat store and
+# embeds/upserts them. Jobs that arrive close together are coalesced into one
+# embedding and upsert pass. The log records each step:
+#   {"op": "job", "id", "user_id", "chat_history", "segment_ids"}  transcript accepted
+#   {"op": "saved", "id", "items": [[unique_id, text], ...]}  segments in the chat store
+#   {"op": "done", "id"}  segments indexed
+#   {"op": "dead", "id"}  given up on, see below
+# so after a crash or restart, start() picks up every job that wasn't done
+# from the step it reached. Segment ids are fixed in the job record, so a save
+# repeated after a crash rewrites the same segments instead of adding copies.
+# Failures are retried with backoff; a job that fails max_attempts times (a
+# segment the API keeps rejecting, a transcript that can't be saved) is moved
+# to <log>.dead in the same record format, so it can be looked at and replayed
+# by appending it to the log, instead of being retried forever. Log reads and
+# writes (and their fsync) run on the blocking-I/O pool. The log is compacted
+# to the unfinished jobs on start and whenever it has grown by COMPACT_BYTES.
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+
+from async_clients import run_blocking
+
+COMPACT_BYTES = 1024 * 1024
+
+
+class _Job:
+    __slots__ = ("id", "user_id", "chat_history", "segment_ids", "items", "attempts")
+
+    def __init__(self, job_id, user_id, chat_history, segment_ids=None, items=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.chat_history = chat_history
+        self.segment_ids = segment_ids
+        self.items = items
+        self.attempts = 0
+
+
+class WriteBehindQueue:
+    def __init__(self, wal_path, save, index, coalesce_delay=0.5, max_batch_jobs=100, retry_delay=5,
+                 max_retry_delay=300, max_attempts=12):
+        """save(user_id, chat_history, segment_ids) -> [(unique_id, text)] runs in a thread;
+        await index(items) -> failed ids. At the default delays a job is retried for about half an hour."""
+        self.wal_path = wal_path
+        self.save = save
+        self.index = index
+        self.coalesce_delay = coalesce_delay
+        self.max_batch_jobs = max_batch_jobs
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.resumed = 0
+        self._jobs = {}
+        self._ready = []
+        self._wal = None
+        self._wakeup = None
+        self._task = None
+        self._busy = False
+        self._draining = False
+        self._retry_handles = {}
+        # Log writes happen on pool threads; the lock keeps appends and compaction from interleaving
+        self._wal_lock = threading.RLock()
+        self._appending = 0
+        self._accepted = 0
+        self._compacted_size = 0
+        self._enqueue_tasks = set()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    # --------------------
+    # Log
+    # --------------------
+    def _load(self):
+        jobs = {}
+        if not os.path.exists(self.wal_path):
+            return jobs
+        with open(self.wal_path, "r") as wal:
+            for line in wal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a record cut off by a crash mid-write
+                if record["op"] == "job":
+                    jobs[record["id"]] = _Job(record["id"], record["user_id"], record["chat_history"],
+                                              record.get("segment_ids"))
+                elif record["op"] == "saved" and record["id"] in jobs:
+                    jobs[record["id"]].items = [tuple(item) for item in record["items"]]
+                elif record["op"] in ("done", "dead"):
+                    jobs.pop(record["id"], None)
+        return jobs
+
+    def _job_records(self, job):
+        records = [{"op": "job", "id": job.id, "user_id": job.user_id, "chat_history": job.chat_history,
+                    "segment_ids": job.segment_ids}]
+        if job.items is not None:
+            records.append({"op": "saved", "id": job.id, "items": job.items})
+        return records
+
+    def _compact(self, jobs):
+        """Rewrite the log with only the given unfinished jobs."""
+        with self._wal_lock:
+            if self._wal is not None:
+                self._wal.close()
+            temp_path = self.wal_path + ".tmp"
+            with open(temp_path, "w") as wal:
+                for job in jobs:
+                    wal.writelines(json.dumps(record) + "\n" for record in self._job_records(job))
+                wal.flush()
+                os.fsync(wal.fileno())
+            os.replace(temp_path, self.wal_path)
+            self._wal = open(self.wal_path, "a")
+            self._compacted_size = self._wal.tell()
+
+    def _compact_if_large(self, jobs, accepted):
+        """Compact to `jobs`, the unfinished jobs when the loop last looked, unless one was accepted since."""
+        with self._wal_lock:
+            # An enqueue writes its job record before it bumps self._accepted and stays counted in
+            # self._appending until then, so checking both under the lock never compacts a job away
+            if self._appending or self._accepted != accepted:
+                return
+            if self._wal is not None and self._wal.tell() > self._compacted_size + COMPACT_BYTES:
+                self._compact(jobs)  # _wal is None once drain() has closed it
+
+    def _open_log(self):
+        with self._wal_lock:
+            self._ensure_folder()
+            jobs = self._load()
+            self._compact(list(jobs.values()))
+        return jobs
+
+    def _dead_letter(self, jobs):
+        with open(self.wal_path + ".dead", "a") as dead:
+            self._write(dead, [record for job in jobs for record in self._job_records(job)])
+        self._append([{"op": "dead", "id": job.id} for job in jobs])
+
+    def _append(self, records):
+        with self._wal_lock:
+            if self._wal is None:
+                # Not running (before start or after drain): the next start() picks the records up
+                self._ensure_folder()
+                with open(self.wal_path, "a") as wal:
+                    self._write(wal, records)
+            else:
+                self._write(self._wal, records)
+
+    @staticmethod
+    def _write(wal, records):
+        wal.write("".join(json.dumps(record) + "\n" for record in records))
+        wal.flush()
+        os.fsync(wal.fileno())
+
+    def _ensure_folder(self):
+        folder = os.path.dirname(self.wal_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    # --------------------
+    # Queue
+    # --------------------
+    def start(self):
+        """Start the background task, which opens the log and resumes every unfinished job in it."""
+        if self._task is not None:
+            return
+        self._draining = False
+        self._jobs = {}
+        self._ready = []
+        self._busy = True  # until the log is open, so drain() waits for the resumed jobs
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def _open(self):
+        # Jobs enqueued meanwhile are written straight to the file; _open_log's lock orders them around the load
+        try:
+            jobs = await run_blocking(self._open_log)
+        finally:
+            self._busy = False
+        resumed = [job_id for job_id in jobs if job_id not in self._jobs]
+        self.resumed = len(resumed)
+        if resumed:
+            print(f"Resuming {len(resumed)} unfinished chat history jobs")
+        self._ready[:0] = resumed
+        for job_id in resumed:
+            self._jobs[job_id] = jobs[job_id]
+
+    async def enqueue(self, user_id, chat_history, segment_ids=None):
+        """Durably accept a finished conversation, returning once it is logged; saving and indexing
+        happen in the background."""
+        job = _Job(uuid.uuid4().hex, user_id, chat_history, segment_ids)
+        # Counted until the job is in self._jobs, so the log isn't compacted out from under it
+        self._appending += 1
+        try:
+            await run_blocking(self._append, self._job_records(job))
+            if self._task is None:
+                return job.id
+            self._jobs[job.id] = job
+            self._accepted += 1
+            self._ready.append(job.id)
+            self._wakeup.set()
+        finally:
+            self._appending -= 1
+        return job.id
+
+    def enqueue_soon(self, user_id, chat_history, segment_ids=None):
+        """enqueue() for synchronous callers on the loop (e.g. session eviction); drain() waits for it."""
+        task = asyncio.get_running_loop().create_task(self.enqueue(user_id, chat_history, segment_ids))
+        self._enqueue_tasks.add(task)
+        task.add_done_callback(self._enqueue_tasks.discard)
+
+    async def drain(self, timeout=30):
+        """Finish outstanding jobs (or give up after timeout, leaving them in the log) and stop."""
+        if self._enqueue_tasks:
+            await asyncio.gather(*self._enqueue_tasks, return_exceptions=True)
+        if self._task is None:
+            return
+        # Jobs waiting out a retry delay get one more immediate attempt; failures from here on stay in the log
+        self._draining = True
+        for job_id, handle in self._retry_handles.items():
+            handle.cancel()
+            self._ready.append(job_id)
+        self._retry_handles.clear()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        while (self._ready or self._busy) and time.monotonic() < deadline and not self._task.done():
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._jobs:
+            print(f"{len(self._jobs)} chat history jobs left in {self.wal_path} for the next start")
+        with self._wal_lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+
+    def _retry_later(self, job):
+        if self._draining:
+            return
+        delay = min(self.retry_delay * 2 ** (job.attempts - 1), self.max_retry_delay)
+
+        def ready():
+            del self._retry_handles[job.id]
+            self._ready.append(job.id)
+            self._wakeup.set()
+        self._retry_handles[job.id] = asyncio.get_running_loop().call_later(delay, ready)
+
+    async def _failed(self, jobs):
+        """Retry failed jobs later, or dead-letter those that have used up max_attempts."""
+        dead = []
+        for job in jobs:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                dead.append(job)
+            else:
+                self._retry_later(job)
+        if not dead:
+            return
+        try:
+            await run_blocking(self._dead_letter, dead)
+        except Exception as e:
+            print(f"Failed to dead-letter {len(dead)} chat history jobs, retrying them: {e}")
+            for job in dead:
+                self._retry_later(job)
+            return
+        print(f"Gave up on {len(dead)} chat history jobs after {self.max_attempts} attempts, "
+              f"moved them to {self.wal_path}.dead")
+        for job in dead:
+            self._jobs.pop(job.id, None)
+
+    async def _run(self):
+        await self._open()
+        while True:
+            await self._wakeup.wait()
+            # Give jobs that end around the same time a moment to arrive so they share batches
+            if self.coalesce_delay and not self._draining:
+                await asyncio.sleep(self.coalesce_delay)
+            self._wakeup.clear()
+            if not self._ready:
+                continue
+            batch = [self._jobs[job_id] for job_id in dict.fromkeys(self._ready[:self.max_batch_jobs])
+                     if job_id in self._jobs]
+            del self._ready[:self.max_batch_jobs]
+            if self._ready:
+                self._wakeup.set()
+            self._busy = True
+            try:
+                await self._process(batch)
+            except Exception as e:
+                print(f"Failed to process chat history jobs: {e}")
+                await self._failed([job for job in batch if job.id in self._jobs])
+            finally:
+                self._busy = False
+            if not self._appending:
+                await run_blocking(self._compact_if_large, list(self._jobs.values()), self._accepted)
+
+    async def _process(self, batch):
+        for job in batch:
+            if job.items is None:
+                saved = await run_blocking(self.save, job.user_id, job.chat_history, job.segment_ids)
+                job.items = [list(item) for item in saved]
+                await run_blocking(self._append, [{"op": "saved", "id": job.id, "items": job.items}])
+
+        # One embedding and upsert pass for the whole batch; segments are upserted by id, so re-indexing is harmless
+        items = {unique_id: text for job in batch for unique_id, text in job.items}
+        failed = set(await self.index(list(items.items()))) if items else set()
+
+        done = [job for job in batch if not any(unique_id in failed for unique_id, _ in job.items)]
+        if done:
+            await run_blocking(self._append, [{"op": "done", "id": job.id} for job in done])
+            for job in done:
+                self._jobs.pop(job.id, None)
+        if failed:
+            print(f"Failed to index {len(failed)} chat log segments, retrying later")
+            await self._failed([job for job in batch if job.id in self._jobs])